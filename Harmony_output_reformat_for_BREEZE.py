@@ -1,7 +1,18 @@
 import os
+import logging
+import numpy as np
 import pandas as pd
 import csv
+import tempfile
+from chunked_store import (ColumnarChunkWriter, distinct_rows, input_bytes, items_per_chunk, iter_chunks, partition_rows, read_partition, scan_path,
+                           write_frames_to_excel, excel_max_rows)
+from excel_cache import read_excel_cached
+from harmony_reader import harmony_export_paths, read_harmony_barcode, read_harmony_exports, reader_threads, signal_column
+from run_report import RunReport, configure_logging
 
+logger = logging.getLogger(__name__)
+
+# Default settings for main(); any of them can be overridden with main(config) or the run_pipeline.py CLI
 # Define folder paths for input and output files
 input_folder_txt = r"C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Image analysis\hit confirmation and re-screen\txt"
 output_folder_csv = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Image analysis\hit confirmation and re-screen\csv'
@@ -13,6 +24,60 @@ combined_file_path = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses
 output_file_path = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Image analysis\Big screen2\Data for BREEZE.xlsx'
 row_start = 9
 
+# Parse each TXT export once and write only the final BREEZE file, instead of the CSV/XLSX round trips
+streaming = True
+
+# Write <BREEZE file>_run_report.json with the stage timings of the streaming pipeline
+run_report = True
+
+# Memory budget (MB) for chunked processing of large screens; None processes all plates at once
+# Chunks of whole plates are appended to <BREEZE file>.parquet, which is then streamed into the BREEZE workbook
+memory_budget_mb = None
+
+# Threads parsing the TXT exports concurrently in the streaming and chunked pipelines
+n_threads = reader_threads
+
+# Plate format of the screen: 96, 384 or 1536 wells
+plate_format = 384
+
+# BREEZE screen annotation
+screen_name = 'KQ_U2OS_PL_10uM_screen'
+screen_concentration = 10000
+
+def default_config():
+    return {
+        'input_folder': input_folder_txt,
+        'csv_folder': output_folder_csv,
+        'excel_folder': output_folder_excel,
+        'conversion_file': conversion_file,
+        'platemap': platemap,
+        'combined_file_path': combined_file_path,
+        'matched_file_path': matched_file_path,
+        'output_file_path': output_file_path,
+        'row_start': row_start,
+        'plate_format': plate_format,
+        'screen_name': screen_name,
+        'concentration': screen_concentration,
+        'streaming': streaming,
+        'run_report': run_report,
+        'memory_budget_mb': memory_budget_mb,
+        'n_threads': n_threads
+    }
+
+# Rows x columns for each supported plate format
+plate_layouts = {96: (8, 12), 384: (16, 24), 1536: (32, 48)}
+
+# Well IDs in plate order (A01, A02, ..., P24 for 384 wells); 1536-well rows continue AA..AF after Z
+def make_well_ids(n_wells):
+    if n_wells not in plate_layouts:
+        raise ValueError(f"Unsupported plate format: {n_wells} wells (expected one of {sorted(plate_layouts)})")
+    n_rows, n_cols = plate_layouts[n_wells]
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    rows = [letters[i] if i < 26 else 'A' + letters[i - 26] for i in range(n_rows)]
+    return [f"{row}{'{:02d}'.format(col)}" for row in rows for col in range(1, n_cols + 1)]
+
+well_ids = make_well_ids(plate_format)
+
 def convert_txt_to_csv(input_folder, output_folder):
     files = [f for f in os.listdir(input_folder) if f.endswith('.txt')]
     for file in files:
@@ -25,12 +90,12 @@ def convert_txt_to_csv(input_folder, output_folder):
             writer.writerows([line.strip().split('\t') for line in data])
 
 def rename_files_based_on_content(input_folder):
-    for file in os.listdir(output_folder_csv):
-        csv_file_path = os.path.join(output_folder_csv, file)
+    for file in os.listdir(input_folder):
+        csv_file_path = os.path.join(input_folder, file)
         with open(csv_file_path, 'r') as file:
             csv_data = list(csv.reader(file))
             new_filename = csv_data[3][1]
-        new_csv_file_path = os.path.join(output_folder_csv, new_filename + '.csv')
+        new_csv_file_path = os.path.join(input_folder, new_filename + '.csv')
         os.rename(csv_file_path, new_csv_file_path)
 
 def truncate_csv_and_save_as_xlsx(csv_folder_path, excel_folder_path, row_start):
@@ -48,55 +113,204 @@ def truncate_csv_and_save_as_xlsx(csv_folder_path, excel_folder_path, row_start)
         excel_file_path = os.path.join(excel_folder_path, os.path.splitext(csv_file)[0] + '.xlsx')
         df.to_excel(excel_file_path, index=False, header=False)
 
-def add_well_id_and_plate_id(directory, conversion_file):
-    conversion_df = pd.read_excel(conversion_file)
-    well_ids = [f"{row}{'{:02d}'.format(col)}" for row in 'ABCDEFGHIJKLMNOP' for col in range(1, 25)]
+def add_well_id_and_plate_id(directory, conversion_file, well_ids=well_ids):
+    plate_ids = barcode_to_plate_id(read_excel_cached(conversion_file))
     for filename in os.listdir(directory):
         if filename.endswith('.xlsx'):
-            file_path = os.path.join(directory, filename)
-            excel_df = pd.read_excel(file_path)
             barcode = os.path.splitext(filename)[0]
-            if barcode in conversion_df['Barcode'].values:
-                plate_id = conversion_df.loc[conversion_df['Barcode'] == barcode, 'PlateID'].values[0]
+            if barcode in plate_ids:
+                file_path = os.path.join(directory, filename)
+                excel_df = pd.read_excel(file_path)
                 excel_df.insert(0, 'WellID', well_ids[:len(excel_df)])
-                excel_df.insert(1, 'PlateID', plate_id)
+                excel_df.insert(1, 'PlateID', plate_ids[barcode])
                 excel_df.to_excel(file_path, index=False)
 
+# First PlateID listed for each barcode, matching the old row-by-row lookup
+def barcode_to_plate_id(conversion_df):
+    conversion_df = conversion_df.drop_duplicates(subset='Barcode', keep='first')
+    return dict(zip(conversion_df['Barcode'], conversion_df['PlateID']))
+
 def combine_files(folder_path, combined_file_path):
-    combined_data = pd.DataFrame()
+    # Collect the plates in a list and concatenate once (DataFrame.append copied the whole table for every plate)
+    plates = []
     for filename in os.listdir(folder_path):
         if filename.endswith('.xlsx'):
             df = pd.read_excel(os.path.join(folder_path, filename))
-            combined_data = combined_data.append(df[['WellID', 'PlateID', 'Cell Selected - Number of Objects']].rename(columns={'Cell Selected - Number of Objects': 'WELL_SIGNAL'}), ignore_index=True)
+            plates.append(df[['WellID', 'PlateID', 'Cell Selected - Number of Objects']].rename(columns={'Cell Selected - Number of Objects': 'WELL_SIGNAL'}))
+    combined_data = pd.concat(plates, ignore_index=True) if plates else pd.DataFrame(columns=['WellID', 'PlateID', 'WELL_SIGNAL'])
     combined_data.to_excel(combined_file_path, index=False)
     
 def merge_and_sort_data(combined_file_path, platemap, matched_file_path):
     combined_data = pd.read_excel(combined_file_path)
-    matching_data = pd.read_excel(platemap)
-    matching_data = matching_data.rename(columns={'Platt ID': 'PlateID', 'Well': 'WellID'})
-    merged_data = pd.merge(combined_data, matching_data, on=['PlateID', 'WellID'], how='left')
-    merged_data = merged_data.sort_values(by='PlateID')
-    plate_mapping = {plate: i + 1 for i, plate in enumerate(merged_data['PlateID'].unique()[:25])}
-    merged_data['PLATE'] = merged_data['PlateID'].map(plate_mapping)
-    merged_data['Batch nr'] = merged_data.apply(lambda row: row['Compound ID'] if row['Batch nr'] in ['DMSO', 'Water'] else row['Batch nr'], axis=1)
+    matching_data = read_excel_cached(platemap)
+    merged_data = merge_with_platemap(combined_data, matching_data)
     merged_data.to_excel(matched_file_path, index=False)
 
-def format_for_breeze(matched_file_path, output_file_path):
-    matched_data = pd.read_excel(matched_file_path).rename(columns={'WellID': 'WELL','Batch nr': 'DRUG_NAME', 'Conc (mM)': 'CONCENTRATION'})
-    matched_data['CONCENTRATION'] = 10000
-    matched_data['SCREEN_NAME'] = 'KQ_U2OS_PL_10uM_screen'
+def merge_with_platemap(combined_data, matching_data, plate_numbers=None):
+    matching_data = matching_data.rename(columns={'Platt ID': 'PlateID', 'Well': 'WellID'})
+    combined_data = combined_data.copy()
+    # Encode both keys as categoricals over the same categories, so the join compares integer codes
+    for key in ['PlateID', 'WellID']:
+        categories = pd.Index(pd.concat([combined_data[key], matching_data[key]]).dropna().unique()).sort_values()
+        combined_data[key] = pd.Categorical(combined_data[key], categories=categories)
+        matching_data[key] = pd.Categorical(matching_data[key], categories=categories)
+    # Index the plate map once by (PlateID, WellID); the first entry wins for duplicated wells
+    platemap_index = matching_data.drop_duplicates(subset=['PlateID', 'WellID']).set_index(['PlateID', 'WellID'])
+    merged_data = combined_data.join(platemap_index, on=['PlateID', 'WellID'])
+    merged_data = merged_data.sort_values(by='PlateID', kind='stable')
+    if plate_numbers is None:
+        # Number the first 25 plates 1..25 in sorted order; the category codes of the plates present give that directly
+        plate_codes = merged_data['PlateID'].cat.remove_unused_categories().cat.codes.to_numpy()
+        merged_data['PLATE'] = np.where((plate_codes >= 0) & (plate_codes < 25), plate_codes + 1, np.nan)
+    else:
+        # Numbers fixed by the caller, e.g. across all chunks of a chunked run
+        merged_data['PLATE'] = merged_data['PlateID'].astype(object).map(plate_numbers).astype(float)
+    # Control wells (DMSO/Water) are named after their compound ID
+    is_control = merged_data['Batch nr'].isin(['DMSO', 'Water']).to_numpy()
+    merged_data['Batch nr'] = np.where(is_control, merged_data['Compound ID'], merged_data['Batch nr'])
+    return merged_data
+
+def format_for_breeze(matched_file_path, output_file_path, screen_name=screen_name, concentration=screen_concentration):
+    matched_data = pd.read_excel(matched_file_path)
+    breeze_data = breeze_columns(matched_data, screen_name=screen_name, concentration=concentration)
+    breeze_data.to_excel(output_file_path, index=False)
+
+def breeze_columns(matched_data, screen_name=screen_name, concentration=screen_concentration):
+    matched_data = matched_data.rename(columns={'WellID': 'WELL','Batch nr': 'DRUG_NAME', 'Conc (mM)': 'CONCENTRATION'})
+    matched_data['CONCENTRATION'] = concentration
+    matched_data['SCREEN_NAME'] = screen_name
     matched_data['DRUG_NAME'] = matched_data['DRUG_NAME'].replace('TAM', 'POS')
-    matched_data[['WELL', 'PLATE', 'DRUG_NAME', 'CONCENTRATION', 'SCREEN_NAME', 'WELL_SIGNAL']].to_excel(output_file_path, index=False)
-
-# Ensure the output folders exist before running the script
-os.makedirs(output_folder_csv, exist_ok=True)
-os.makedirs(output_folder_excel, exist_ok=True)
-
-# Execute all steps
-convert_txt_to_csv(input_folder_txt, output_folder_csv)
-rename_files_based_on_content(output_folder_csv)
-truncate_csv_and_save_as_xlsx(output_folder_csv, output_folder_excel, row_start)
-add_well_id_and_plate_id(output_folder_excel, conversion_file)
-combine_files(output_folder_excel, combined_file_path)
-merge_and_sort_data(combined_file_path, platemap, matched_file_path)
-format_for_breeze(matched_file_path, output_file_path)
+    return matched_data[['WELL', 'PLATE', 'DRUG_NAME', 'CONCENTRATION', 'SCREEN_NAME', 'WELL_SIGNAL']]
+
+# WellID/PlateID/WELL_SIGNAL table of one plate
+def plate_frame(signals, plate_id, well_ids):
+    return pd.DataFrame({
+        'WellID': well_ids[:len(signals)],
+        'PlateID': plate_id,
+        'WELL_SIGNAL': pd.to_numeric(signals, errors='coerce')
+    })
+
+# Yield one WellID/PlateID/WELL_SIGNAL table per plate that has a PlateID in the conversion file
+# The exports are parsed n_threads at a time; only their signal column is kept
+def stream_harmony_plates(input_folder, conversion_file, row_start, plate_format=plate_format, n_threads=n_threads):
+    plate_ids = barcode_to_plate_id(read_excel_cached(conversion_file))
+    well_ids = make_well_ids(plate_format)
+    for barcode, data in read_harmony_exports(harmony_export_paths(input_folder), row_start, n_threads=n_threads):
+        if barcode not in plate_ids:
+            continue
+        yield plate_frame(data[signal_column].to_numpy(), plate_ids[barcode], well_ids)
+
+# DataFrame in, DataFrame out: WellID/PlateID/WELL_SIGNAL rows annotated from the plate map in BREEZE layout
+def build_breeze_table(combined_data, platemap_data, screen_name=screen_name, concentration=screen_concentration):
+    merged_data = merge_with_platemap(combined_data, platemap_data)
+    return breeze_columns(merged_data, screen_name=screen_name, concentration=concentration)
+
+# Collect all plates in memory and write the BREEZE table once at the end
+def run_streaming_pipeline(input_folder, conversion_file, platemap, output_file_path, row_start, plate_format=plate_format,
+                           screen_name=screen_name, concentration=screen_concentration, report=None, n_threads=n_threads):
+    report = report or RunReport('breeze')
+    with report.stage('parse'):
+        plates = list(stream_harmony_plates(input_folder, conversion_file, row_start, plate_format, n_threads=n_threads))
+        combined_data = pd.concat(plates, ignore_index=True)
+    with report.stage('merge', len(combined_data)):
+        breeze_data = build_breeze_table(combined_data, read_excel_cached(platemap), screen_name=screen_name, concentration=concentration)
+    with report.stage('write', len(breeze_data)):
+        breeze_data.to_excel(output_file_path, index=False)
+    return breeze_data
+
+# Same output as run_streaming_pipeline, but only one chunk of plates is held in memory at a time
+def run_chunked_pipeline(input_folder, conversion_file, platemap, output_file_path, row_start, memory_budget_mb, plate_format=plate_format,
+                         screen_name=screen_name, concentration=screen_concentration, report=None, n_threads=n_threads):
+    report = report or RunReport('breeze')
+    plate_ids = barcode_to_plate_id(read_excel_cached(conversion_file))
+    well_ids = make_well_ids(plate_format)
+
+    # The BREEZE table is sorted by PlateID, so whole plates are processed in PlateID order
+    with report.stage('scan'):
+        plate_files = []
+        for txt_path in harmony_export_paths(input_folder):
+            barcode = read_harmony_barcode(txt_path)
+            if barcode in plate_ids:
+                plate_files.append((plate_ids[barcode], txt_path))
+        plate_files.sort(key=lambda plate_file: plate_file[0])
+        plate_order = sorted({plate_id for plate_id, _ in plate_files})
+        plate_numbers = {plate: i + 1 for i, plate in enumerate(plate_order[:25])}
+
+    # Each chunk holds whole plates; one scan of the plate map's Parquet sidecar splits its rows by chunk up front,
+    # so every chunk reads only the rows of its own plates
+    platemap_path = scan_path(platemap)
+    platemap_plates = set(distinct_rows(platemap_path, ['Platt ID'])['Platt ID'])
+    chunk_size = items_per_chunk(memory_budget_mb, input_bytes(platemap_path) / max(len(platemap_plates), 1))
+    chunk_plates = [plate_order[start:start + chunk_size] for start in range(0, len(plate_order), chunk_size)]
+    chunk_of_plate = {plate: chunk for chunk, plates in enumerate(chunk_plates) for plate in plates}
+    chunk_files = [[] for _ in chunk_plates]
+    for plate_id, txt_path in plate_files:
+        chunk_files[chunk_of_plate[plate_id]].append((plate_id, txt_path))
+    logger.info("Processing %d plates in %d chunks", len(plate_order), len(chunk_plates))
+
+    store_path = output_file_path if output_file_path.endswith('.parquet') else os.path.splitext(output_file_path)[0] + '.parquet'
+    with tempfile.TemporaryDirectory(prefix='breeze_platemap_') as platemap_parts, ColumnarChunkWriter(store_path) as writer:
+        with report.stage('split', len(plate_order)):
+            partition_rows(platemap_path, 'Platt ID', [[plate for plate in plates if plate in platemap_plates] for plates in chunk_plates],
+                           platemap_parts)
+        for chunk, files in enumerate(chunk_files):
+            with report.stage('parse', len(files)):
+                exports = read_harmony_exports([txt_path for _, txt_path in files], row_start, n_threads=n_threads)
+                combined_data = pd.concat([plate_frame(data[signal_column].to_numpy(), plate_id, well_ids) for (plate_id, _), (_, data) in zip(files, exports)],
+                                          ignore_index=True)
+            with report.stage('merge', len(combined_data)):
+                chunk_platemap = read_partition(platemap_path, platemap_parts, chunk)
+                breeze_data = breeze_columns(merge_with_platemap(combined_data, chunk_platemap, plate_numbers),
+                                             screen_name=screen_name, concentration=concentration)
+            with report.stage('store', len(breeze_data)):
+                writer.append(breeze_data)
+        rows = writer.rows
+
+    # Stream the stored chunks into the BREEZE workbook unless the Parquet store is the requested output
+    if store_path != output_file_path:
+        if rows + 1 > excel_max_rows:
+            logger.warning("%d rows do not fit in one Excel sheet; the BREEZE table is kept in %s only", rows, store_path)
+        else:
+            with report.stage('write', rows):
+                write_frames_to_excel(iter_chunks(store_path), output_file_path)
+    return store_path
+
+# Run the conversion for one screen; config overrides the defaults at the top of this file
+def main(config=None):
+    config = dict(default_config(), **(config or {}))
+    if config['streaming'] and config['memory_budget_mb'] is not None:
+        report = RunReport('breeze')
+        store_path = run_chunked_pipeline(config['input_folder'], config['conversion_file'], config['platemap'], config['output_file_path'],
+                                          config['row_start'], config['memory_budget_mb'], plate_format=config['plate_format'],
+                                          screen_name=config['screen_name'], concentration=config['concentration'], report=report,
+                                          n_threads=config['n_threads'])
+        if config['run_report']:
+            report.write(os.path.splitext(config['output_file_path'])[0] + '_run_report')
+        return store_path
+    if config['streaming']:
+        report = RunReport('breeze')
+        breeze_data = run_streaming_pipeline(config['input_folder'], config['conversion_file'], config['platemap'], config['output_file_path'],
+                                             config['row_start'], plate_format=config['plate_format'],
+                                             screen_name=config['screen_name'], concentration=config['concentration'], report=report,
+                                             n_threads=config['n_threads'])
+        if config['run_report']:
+            report.write(os.path.splitext(config['output_file_path'])[0] + '_run_report')
+        return breeze_data
+
+    # The legacy chain writes its CSV/XLSX intermediates to csv_folder, excel_folder, combined_file_path and matched_file_path
+    # Ensure the output folders exist before running the script
+    os.makedirs(config['csv_folder'], exist_ok=True)
+    os.makedirs(config['excel_folder'], exist_ok=True)
+
+    # Execute all steps
+    convert_txt_to_csv(config['input_folder'], config['csv_folder'])
+    rename_files_based_on_content(config['csv_folder'])
+    truncate_csv_and_save_as_xlsx(config['csv_folder'], config['excel_folder'], config['row_start'])
+    add_well_id_and_plate_id(config['excel_folder'], config['conversion_file'], make_well_ids(config['plate_format']))
+    combine_files(config['excel_folder'], config['combined_file_path'])
+    merge_and_sort_data(config['combined_file_path'], config['platemap'], config['matched_file_path'])
+    format_for_breeze(config['matched_file_path'], config['output_file_path'], screen_name=config['screen_name'], concentration=config['concentration'])
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
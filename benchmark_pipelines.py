@@ -0,0 +1,153 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+from datetime import datetime
+import matplotlib
+import numpy as np
+import pandas as pd
+import scipy
+import combine_IC50curves_by_cell_line as cell_line_pipeline
+import merge_IC50curves_by_timepoints as time_point_pipeline
+import Harmony_output_reformat_for_BREEZE as breeze_pipeline
+from data_partition import partition_frame
+from excel_cache import read_excel_cached, cache_dir_name
+from run_report import RunReport, configure_logging, peak_memory_mb
+from summary_workbook import write_summary_workbook
+from synthetic_screens import make_cell_line_tables, make_time_point_tables, make_harmony_plates, write_harmony_plates
+
+
+# Time every pipeline stage on a synthetic screen of n_drugs drugs, batches and compounds
+def run_size(n_drugs, workdir, max_plots=200, plate_format=384, seed=0):
+    timer = RunReport(f'{n_drugs} drugs')
+    folder = os.path.join(workdir, f'{n_drugs}_drugs')
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    txt_folder = os.path.join(folder, 'txt')
+    plot_dir = os.path.join(folder, 'plots')
+    os.makedirs(plot_dir)
+
+    # Synthetic inputs: cell-line tables, time-point tables and Harmony plate exports
+    with timer.stage('generate', n_drugs):
+        cell_line_tables = make_cell_line_tables(n_drugs, seed=seed)
+        time_point_tables, initial_guesses = make_time_point_tables(n_drugs, seed=seed)
+        plates, conversion, platemap = make_harmony_plates(n_drugs, plate_format=plate_format, seed=seed)
+        write_harmony_plates(txt_folder, plates, row_start=9)
+
+    # Excel I/O on the same files the pipelines read
+    excel_files = {}
+    for cell_line in cell_line_tables:
+        excel_files[cell_line] = os.path.join(folder, f'{cell_line}_DSRT_analysis_table_Rpipeline_IC50.xlsx')
+    for time_point in time_point_tables:
+        excel_files[time_point] = os.path.join(folder, f'dose_response_{time_point}h.xlsx')
+    excel_files['initial_guesses'] = os.path.join(folder, 'initial_guesses.xlsx')
+    excel_files['conversion'] = os.path.join(folder, 'plate_conversion.xlsx')
+    excel_files['platemap'] = os.path.join(folder, 'platemap.xlsx')
+    tables = {**cell_line_tables, **time_point_tables, 'initial_guesses': initial_guesses, 'conversion': conversion, 'platemap': platemap}
+    total_rows = sum(len(table) for table in tables.values())
+
+    with timer.stage('excel_write', total_rows):
+        for key, path in excel_files.items():
+            tables[key].to_excel(path, index=False)
+    with timer.stage('excel_read', total_rows):
+        for path in excel_files.values():
+            pd.read_excel(path)
+    with timer.stage('excel_read_cached_cold', total_rows):
+        for path in excel_files.values():
+            read_excel_cached(path)
+    with timer.stage('excel_read_cached_warm', total_rows):
+        for path in excel_files.values():
+            read_excel_cached(path)
+
+    # BREEZE reformatting: TXT parsing, then the plate-map join
+    with timer.stage('txt_parse', len(plates)):
+        combined_plates = pd.concat(breeze_pipeline.stream_harmony_plates(txt_folder, excel_files['conversion'], 9, plate_format), ignore_index=True)
+    with timer.stage('breeze_merge', len(combined_plates)):
+        breeze_pipeline.build_breeze_table(combined_plates, read_excel_cached(excel_files['platemap']))
+
+    # Cell-line pipeline: one batched Hill fit over every (drug, cell line) row
+    data = cell_line_pipeline.load_cell_lines({cell_line: excel_files[cell_line] for cell_line in cell_line_tables})
+    with timer.stage('hill_fit', len(data)):
+        fitted = cell_line_pipeline.fit_cell_line_curves(data)
+
+    # Time-point pipeline: the per-batch curve_fit loop, without plots
+    combined_data = time_point_pipeline.load_time_points({time_point: excel_files[time_point] for time_point in time_point_tables}, excel_files['initial_guesses'])
+    combined_data['condition'] = time_point_pipeline.condition_labels(combined_data, ['time'])
+    batch_partitions = partition_frame(combined_data, 'Batch_nr')
+    with timer.stage('logistic_fit', len(batch_partitions) * len(time_point_tables)):
+        for batch, batch_data in batch_partitions:
+            time_point_pipeline.plot_ic50_curve(batch_data, batch, conditions=tuple(f'{time}h' for time in time_point_tables))
+
+    # Plotting is timed on the first max_plots drugs; the rest are summarized without a PNG
+    drug_partitions = partition_frame(fitted, 'DRUG_NAME')
+    n_plots = min(max_plots, len(drug_partitions))
+    results = {}
+    with timer.stage('plotting', n_plots):
+        for drug, drug_data in drug_partitions[:n_plots]:
+            results[drug] = cell_line_pipeline.plot_ic50_curve(drug_data, drug, plot_dir=plot_dir)
+    with timer.stage('summarize', len(drug_partitions)):
+        for drug, drug_data in drug_partitions[n_plots:]:
+            results[drug] = cell_line_pipeline.plot_ic50_curve(drug_data, drug)
+        summary = cell_line_pipeline.summary_table(results, list(cell_line_tables))
+    with timer.stage('workbook', len(summary)):
+        write_summary_workbook(summary, os.path.join(folder, 'IC50_summary_with_plots.xlsx'), "IC50 Summary")
+
+    shutil.rmtree(os.path.join(folder, cache_dir_name), ignore_errors=True)
+    return {
+        'n_drugs': n_drugs,
+        'n_plates': len(plates),
+        'plate_format': plate_format,
+        'stages': {name: {
+            'seconds': round(stage['seconds'], 6),
+            'items': stage['items'],
+            'ms_per_item': round(1000 * stage['seconds'] / stage['items'], 6) if stage['items'] else None
+        } for name, stage in timer.stages.items()},
+        'total_seconds': round(sum(stage['seconds'] for stage in timer.stages.values()), 6),
+        'peak_memory_mb': peak_memory_mb()
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic screens and write a JSON report.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help="Numbers of drugs to benchmark")
+    parser.add_argument('--workdir', default='benchmark_data', help="Folder for the synthetic inputs and outputs")
+    parser.add_argument('--report', default='benchmark_report.json', help="JSON report to write")
+    parser.add_argument('--max-plots', type=int, default=200, help="Drugs plotted per size (plotting is timed on these)")
+    parser.add_argument('--plate-format', type=int, choices=[96, 384, 1536], default=384, help="Wells per Harmony plate")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument('--verbose', action='store_true', help="Also log the pipelines' per-fit warnings")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    if not args.verbose:
+        # Per-fit warnings would flood the console and skew the timings
+        for pipeline in (cell_line_pipeline, time_point_pipeline, breeze_pipeline):
+            logging.getLogger(pipeline.__name__).setLevel(logging.ERROR)
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'environment': environment(), 'runs': []}
+    for n_drugs in args.sizes:
+        logging.getLogger(__name__).info("Benchmarking %d drugs", n_drugs)
+        report['runs'].append(run_size(n_drugs, args.workdir, max_plots=args.max_plots, plate_format=args.plate_format, seed=args.seed))
+        # Write after every size so a long run still leaves a report behind
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import logging
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from excel_cache import excel_parquet_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pq = None
+
+logger = logging.getLogger(__name__)
+
+# Rough number of copies of an item's input rows that fitting, plotting and result bookkeeping hold at once
+working_set_factor = 20
+
+# Rows per worksheet in Excel, including the header
+excel_max_rows = 1048576
+
+
+# How many items (drugs, batches, plates) can be processed together within the memory budget
+def items_per_chunk(memory_budget_mb, bytes_per_item, working_set_factor=working_set_factor):
+    item_bytes = max(bytes_per_item * working_set_factor, 1)
+    return max(1, int(memory_budget_mb * 2 ** 20 // item_bytes))
+
+
+# The file an input table is scanned from: a CSV or Parquet input itself, a workbook through its Parquet sidecar
+def scan_path(path):
+    if pq is None:
+        raise ImportError("Chunked processing needs pyarrow to scan its inputs")
+    if path.endswith(('.csv', '.parquet')):
+        return path
+    sidecar = excel_parquet_path(path)
+    if sidecar is None:
+        raise ValueError(f"{path} cannot be stored as Parquet, so it cannot be read in chunks; run it without a memory budget")
+    return sidecar
+
+
+# A Parquet or CSV file (by extension), which pyarrow scans one record batch at a time
+def _dataset(path):
+    return ds.dataset(path, format='csv' if path.endswith('.csv') else 'parquet')
+
+
+# Uncompressed data size of a Parquet file, or the size of a CSV file
+def input_bytes(path):
+    if path.endswith('.csv'):
+        return os.path.getsize(path)
+    metadata = pq.ParquetFile(path).metadata
+    return sum(metadata.row_group(i).total_byte_size for i in range(metadata.num_row_groups))
+
+
+# Column names of a Parquet or CSV file, in file order
+def column_names(path):
+    return list(_dataset(path).schema.names)
+
+
+# Distinct rows of some columns of a Parquet or CSV file in first-appearance order, decoding one record batch at a time
+def distinct_rows(path, columns):
+    dataset = _dataset(path)
+    distinct = dataset.schema.empty_table().select(list(columns)).to_pandas()
+    for batch in dataset.to_batches(columns=list(columns)):
+        frame = batch.to_pandas().drop_duplicates()
+        distinct = frame if distinct.empty else pd.concat([distinct, frame], ignore_index=True).drop_duplicates(ignore_index=True)
+    return distinct
+
+
+# Split the rows of a Parquet or CSV file by chunk in one scan: the rows whose key is in chunk_keys[i] go to the
+# Parquet dataset directory/<i>, along with their position in the file; rows of no chunk are left out
+# Each key belongs to one chunk, so the whole split holds every row at most once
+def partition_rows(path, key_column, chunk_keys, directory):
+    dataset = _dataset(path)
+    value_set = pa.array([key for keys in chunk_keys for key in keys]).cast(dataset.schema.field(key_column).type)
+    chunk_of_key = pa.array(np.repeat(np.arange(len(chunk_keys)), [len(keys) for keys in chunk_keys]), type=pa.int32())
+    schema = dataset.schema.append(pa.field('_row', pa.int64())).append(pa.field('_chunk', pa.int32()))
+
+    def batches():
+        offset = 0
+        for batch in dataset.to_batches():
+            index = pc.index_in(batch.column(key_column), value_set=value_set)
+            table = pa.Table.from_batches([batch], schema=dataset.schema)
+            table = table.append_column('_row', pa.array(np.arange(offset, offset + batch.num_rows)))
+            table = table.append_column('_chunk', pc.take(chunk_of_key, index))
+            offset += batch.num_rows
+            yield from table.filter(pc.is_valid(index)).to_batches()
+
+    ds.write_dataset(batches(), directory, schema=schema, format='parquet',
+                     partitioning=ds.partitioning(pa.schema([schema.field('_chunk')])),
+                     max_partitions=max(len(chunk_keys), 1), existing_data_behavior='overwrite_or_ignore')
+
+
+# The rows of one chunk split off path by partition_rows, in file order
+def read_partition(path, directory, chunk):
+    chunk_directory = os.path.join(directory, str(chunk))
+    if not os.path.isdir(chunk_directory):
+        return _dataset(path).schema.empty_table().to_pandas()
+    table = ds.dataset(chunk_directory, format='parquet').to_table()
+    return table.sort_by('_row').drop_columns(['_row']).to_pandas()
+
+
+# Yield the rows of several input files in chunks of whole keys (drugs, batches), sized to the memory budget
+# sources holds (path from scan_path, key column, prepare) triples; only the distinct keys are collected up front,
+# then one scan of every input splits its rows by chunk into a temporary Parquet dataset (see partition_rows), and
+# each chunk reads back just its own rows through prepare. Peak memory is one chunk plus one scanned record batch,
+# and every input is read twice in total, however many chunks there are
+def iter_source_chunks(sources, memory_budget_mb):
+    keys = pd.unique(pd.concat([distinct_rows(path, [key_column])[key_column] for path, key_column, _ in sources]).dropna())
+    bytes_per_key = sum(input_bytes(path) for path, _, _ in sources) / max(len(keys), 1)
+    chunk_size = items_per_chunk(memory_budget_mb, bytes_per_key)
+    chunk_keys = [keys[start:start + chunk_size] for start in range(0, len(keys), chunk_size)]
+    logger.info("Processing %d keys in %d chunks", len(keys), len(chunk_keys))
+    with tempfile.TemporaryDirectory(prefix='chunked_store_') as directory:
+        for i, (path, key_column, _) in enumerate(sources):
+            partition_rows(path, key_column, chunk_keys, os.path.join(directory, str(i)))
+        for chunk in range(len(chunk_keys)):
+            yield pd.concat([prepare(read_partition(path, os.path.join(directory, str(i)), chunk))
+                             for i, (path, _, prepare) in enumerate(sources)])
+
+
+# Appends DataFrame chunks to one Parquet file, one row group per chunk, under a temporary name that close() moves
+# into place, so an interrupted run never leaves a truncated store
+# The schema is taken from the first chunk; columns entirely missing in it are stored as strings
+class ColumnarChunkWriter:
+    def __init__(self, path):
+        if pq is None:
+            raise ImportError("Chunked processing needs pyarrow for its on-disk Parquet store")
+        self.path = path
+        self.schema = None
+        self.writer = None
+        self.rows = 0
+
+    def append(self, frame):
+        if self.writer is None:
+            schema = pa.Schema.from_pandas(frame, preserve_index=False)
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, pa.field(field.name, pa.string()))
+            self.schema = schema
+            self.writer = pq.ParquetWriter(self.path + '.tmp', self.schema)
+        self.writer.write_table(pa.Table.from_pandas(frame, schema=self.schema, preserve_index=False))
+        self.rows += len(frame)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.path + '.tmp', self.path)
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.writer is not None:
+            self.writer.close()
+            os.remove(self.path + '.tmp')
+
+
+# Read a store written by ColumnarChunkWriter back one row group (chunk) at a time
+def iter_chunks(path):
+    parquet_file = pq.ParquetFile(path)
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i).to_pandas()
+
+
+# Stream DataFrame chunks into one worksheet as DataFrame.to_excel(index=False) would lay it out
+# A write-only workbook keeps no cells in memory, so only one chunk is held at a time
+def write_frames_to_excel(frames, excel_path, sheet_name='Sheet1'):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    header_written = False
+    for frame in frames:
+        if not header_written:
+            ws.append(list(frame.columns))
+            header_written = True
+        for values in frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None):
+            ws.append(list(values))
+    wb.save(excel_path)
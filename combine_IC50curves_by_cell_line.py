@@ -1,188 +1,379 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+import logging
 import os
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-import win32com.client
-
-# Define the base directory and file paths for the four Excel files
-base_dir = r'C:\Users\kun.qian\Desktop\Projects\Nordic Oncology Library\screening test\FiMMs comparison\python combined dose curves\four cell lines'
-file_paths = {
-    'HL60': os.path.join(base_dir, 'HL60_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
-    'Kuramochi': os.path.join(base_dir, 'Kuramochi_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
-    'MOLM13': os.path.join(base_dir, 'MOLM13_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
-    'Ovcar8': os.path.join(base_dir, 'Ovcar8_DSRT_analysis_table_Rpipeline_IC50.xlsx')
-}
-
-# Load data from each file into a dictionary of DataFrames
-data_frames = {}
-for cell_line, path in file_paths.items():
-    df = pd.read_excel(path)
-    df['Cell_Line'] = cell_line  # Add a column to identify the cell line
-    data_frames[cell_line] = df
-
-# Combine the data into a single DataFrame
-data = pd.concat(data_frames.values(), ignore_index=True)
-
-# Extract relevant columns, assuming the column 'Cell_Line' identifies different cell lines
-data = data[['ID', 'DRUG_NAME', 'Cell_Line', 'D1', 'D2', 'D3', 'D4', 'D5', 'IC50', 'DSS', 'SLOPE', 'MAX', 'MIN', 'Max.Conc.tested']]
-
-# Remove rows with any inf or NaN values
-data = data.replace([np.inf, -np.inf], np.nan).dropna()
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hill_fitting import fit_hill_batch
+from ic50_intervals import bootstrap_ic50_interval, covariance_ic50_interval
+from data_partition import partition_frame
+from excel_cache import read_excel_cached
+from chunked_store import iter_source_chunks, scan_path
+from curve_pipeline import output_paths, plots_rendered, run_curve_pipeline, render_stored_plots as render_stored_curve_plots
+from result_store import input_hash, load_result_store, cached_result, ResultStoreWriter
+from curve_renderer import shared_renderer, smooth_concentrations
+from run_report import RunReport, configure_logging, fit_quality
+
+logger = logging.getLogger(__name__)
+
+# Default settings for main(); any of them can be overridden with main(config) or the run_pipeline.py CLI
+# The R-pipeline IC50 table of each cell line, by cell line name
+file_paths = {}
+
+# Output locations for the plots and the summary workbook
+# Without an output_dir no plots are drawn; main() needs an excel_path
+output_dir = None
+initial_excel_path = None
+
+# Number of worker processes used to plot the drugs (1 runs everything in this process)
+n_workers = 1
+
+# Only refit and replot drugs whose input rows or fit settings changed since the last run
+# Without a result_store_path nothing is stored; main() then keeps the store next to the summary workbook
+incremental = True
+result_store_path = None
+
+# Write <summary workbook>_run_report.json and _run_report_fits.csv with stage timings and per-fit statistics
+run_report = True
+
+# Summary output, one of curve_pipeline.output_formats
+output_format = 'xlsx'
+
+# Memory budget (MB) for processing the drugs in chunks; None processes all drugs at once
+memory_budget_mb = None
+
+# Confidence level (e.g. 0.95) of the IC50_calc intervals from the Hill fit covariance; None leaves them out
+# bootstrap_samples residual resamples are refitted per row for the bootstrap bounds (0 skips them)
+confidence_level = None
+bootstrap_samples = 1000
+bootstrap_seed = 0
+
+# Plot settings: render_plots = False skips the PNGs, they can be drawn later with render_stored_plots()
+# None draws them unless output_format is 'html', whose report draws the curves itself
+render_plots = None
+plot_dpi = 100  # Lower for thumbnails
+
+# Concentrations for D1, D2, D3, D4, and D5 are based on max conc only
+dilutions = np.array([10000, 1000, 100, 10, 1])
+
+# Everything that changes the fitted result; part of each drug's content hash
+fit_settings = {'model': 'hill', 'dilutions': dilutions.tolist(), 'max_iter': 2000, 'early_exit': True}
+
+# Layout of the stored drug results; drugs stored under another version are refitted
+result_version = 5
+
+def default_config():
+    return {
+        'file_paths': dict(file_paths),
+        'output_dir': output_dir,
+        'excel_path': initial_excel_path,
+        'n_workers': n_workers,
+        'incremental': incremental,
+        'result_store_path': result_store_path,
+        'render_plots': render_plots,
+        'plot_dpi': plot_dpi,
+        'run_report': run_report,
+        'output_format': output_format,
+        'memory_budget_mb': memory_budget_mb,
+        'confidence_level': confidence_level,
+        'bootstrap_samples': bootstrap_samples,
+        'bootstrap_seed': bootstrap_seed
+    }
 
 # Create a function to fit the Hill equation
 def hill_equation(concentration, ic50, hill_slope, min_resp, max_resp):
     concentration = np.clip(concentration, 1e-10, np.inf)  # Avoid extremely small values
     return min_resp + (max_resp - min_resp) / (1 + np.power(concentration / ic50, hill_slope))
 
-# Create output directory for plots
-output_dir = os.path.join(base_dir, 'ic50_plots')
-os.makedirs(output_dir, exist_ok=True)
-
-# Create a new Excel workbook
-wb = Workbook()
-ws = wb.active
-ws.title = "IC50 Summary"
-
-# Write the header row
-header = [
-    'Drug Name', 'HL60 IC50', 'Kuramochi IC50', 'MOLM13 IC50', 'Ovcar8 IC50',
-    'HL60 DSS', 'Kuramochi DSS', 'MOLM13 DSS', 'Ovcar8 DSS',
-    'HL60 IC50_calc', 'Kuramochi IC50_calc', 'MOLM13 IC50_calc', 'Ovcar8 IC50_calc', 'GRAPH'
-]
-ws.append(header)
-
-# Adjust column width for the 'GRAPH' column
-graph_col_letter = get_column_letter(len(header))
-ws.column_dimensions[graph_col_letter].width = 40  # Adjust as needed
-
-# Save the initial workbook
-initial_excel_path = os.path.join(base_dir, 'IC50_summary_with_plots.xlsx')
-wb.save(initial_excel_path)
-
-# Plotting function
-def plot_ic50_curve(drug_data, drug_name):
-    plt.figure(figsize=(6, 4))  # Adjust the figure size as needed
+# Draw the fitted curves and data points of one drug with the shared Agg renderer
+def draw_curves(curves, drug_name, plot_filename, dpi=plot_dpi):
+    series = []
+    for curve in curves:
+        concentrations_smooth = smooth_concentrations(curve['concentrations'])
+        response_smooth = hill_equation(concentrations_smooth, *curve['params'])
+        series.append((curve['label'], concentrations_smooth, response_smooth, curve['concentrations'], curve['responses']))
+    shared_renderer(dpi=dpi).render(plot_filename, f'IC50 Curves for {drug_name}', series)
+
+# Plotting function; plot_dir=None skips drawing the PNG
+def plot_ic50_curve(drug_data, drug_name, plot_dir=None, dpi=plot_dpi):
+    cell_lines = []
     ic50_values = []
     dss_values = []
     ic50_calc_values = []
+    fit_params = []
+    fit_evaluations = []
+    fit_stats = []
+    ic50_intervals = []
+    curves = []
     
-    for cell_line in drug_data['Cell_Line'].unique():
-        cell_line_data = drug_data[drug_data['Cell_Line'] == cell_line]
-        
+    for cell_line, cell_line_data in partition_frame(drug_data, 'Cell_Line'):
         for index, row in cell_line_data.iterrows():
-            # Calculate concentrations for D1, D2, D3, D4, and D5 based on max conc only
             max_conc = row['Max.Conc.tested']
-            concentrations_tested = np.array([max_conc / 10000, max_conc / 1000, max_conc / 100, max_conc / 10, max_conc])
-            data_points = row[['D1', 'D2', 'D3', 'D4', 'D5']].values
+            concentrations_tested = max_conc / dilutions
+            data_points = row[['D1', 'D2', 'D3', 'D4', 'D5']].to_numpy(dtype=float)
+            cell_lines.append(cell_line)
+            fit_params.append([row['IC50_calc'], row['SLOPE_calc'], row['MIN_calc'], row['MAX_calc']])
+            fit_evaluations.append(int(row['FIT_EVALS']))
+            ic50_intervals.append([row.get(column, np.nan) for column in interval_columns])
+            fit_stats.append({
+                'label': f"{cell_line} - {row['ID']}",
+                'status': row['FIT_STATUS'],
+                'evaluations': int(row['FIT_EVALS']),
+                'seconds': row['FIT_SECONDS'],
+                'r_squared': row['FIT_R2'],
+                'rmse': row['FIT_RMSE']
+            })
             
-            # Initial guesses for curve fitting
-            initial_guesses = [row['IC50'], row['SLOPE'], row['MIN'], row['MAX']]
-            
-            # Fit the Hill equation to the data points
-            try:
-                popt, _ = curve_fit(hill_equation, concentrations_tested, data_points, p0=initial_guesses, bounds=(0, [np.inf, np.inf, np.inf, np.inf]), maxfev=2000)
-                ic50, hill_slope, min_resp, max_resp = popt
-                
-                # Generate smooth curve for plotting
-                concentrations_smooth = np.logspace(np.log10(concentrations_tested[0]), np.log10(concentrations_tested[-1]), 100)
-                response_smooth = hill_equation(concentrations_smooth, ic50, hill_slope, min_resp, max_resp)
-                
-                color = next(plt.gca()._get_lines.prop_cycler)['color']  # Get the current color
-                
-                plt.plot(concentrations_smooth, response_smooth, label=f"{cell_line} - {row['ID']}", color=color)
-                # Plotting the actual data points as dots
-                plt.scatter(concentrations_tested, data_points, marker='o', color=color)
-                ic50_values.append(row['IC50'])
-                dss_values.append(row['DSS'])
-                ic50_calc_values.append(ic50)
-            except RuntimeError:
-                print(f"Optimal parameters not found for {drug_name} in {cell_line} - {row['ID']}")
-                ic50_values.append(np.nan)
-                dss_values.append(row['DSS'])
-                ic50_calc_values.append(np.nan)
-            except ValueError:
-                print(f"Invalid values encountered for {drug_name} in {cell_line} - {row['ID']}")
+            # Rows that did not converge in the batched fit carry NaN parameters
+            if np.isnan(row['IC50_calc']):
+                logger.warning("Optimal parameters not found for %s in %s - %s (%s)", drug_name, cell_line, row['ID'], row['FIT_STATUS'])
                 ic50_values.append(np.nan)
                 dss_values.append(row['DSS'])
                 ic50_calc_values.append(np.nan)
-    
-    plt.xscale('log')
-    plt.xlabel('Concentration')
-    plt.ylabel('Response')
-    plt.title(f'IC50 Curves for {drug_name}')
-    plt.legend()
-    plt.grid(True)
+                continue
+            
+            curves.append({
+                'label': f"{cell_line} - {row['ID']}",
+                'params': fit_params[-1],
+                'concentrations': concentrations_tested.tolist(),
+                'responses': data_points.tolist()
+            })
+            ic50_values.append(row['IC50'])
+            dss_values.append(row['DSS'])
+            ic50_calc_values.append(row['IC50_calc'])
     
     # Save the plot to a file
-    plot_filename = os.path.join(output_dir, f'{drug_name}_ic50_curve.png')
-    plt.savefig(plot_filename, bbox_inches='tight')
-    plt.close()
-    
-    return plot_filename, ic50_values, dss_values, ic50_calc_values
-
-# Generate plots for each drug
-plot_filenames = []
-unique_drugs = data['DRUG_NAME'].unique()
-for drug in unique_drugs:
-    drug_data = data[data['DRUG_NAME'] == drug]
-    plot_filename, ic50_values, dss_values, ic50_calc_values = plot_ic50_curve(drug_data, drug)
-    
-    # Append IC50, DSS values, and calculated IC50 to the worksheet
-    row_idx = ws.max_row + 1
-    ws.append([drug] + ic50_values + dss_values + ic50_calc_values + [''])  # Append calculated IC50 values
-    plot_filenames.append((plot_filename, row_idx))
-
-# Save the workbook
-wb.save(initial_excel_path)
-
-# Insert images into the Excel workbook using win32com.client
-Excel = win32com.client.Dispatch("Excel.Application")
-Excel.Visible = False
-wb_win32 = Excel.Workbooks.Open(initial_excel_path)
-ws_win32 = wb_win32.Worksheets("IC50 Summary")
-
-# Find the column named "GRAPH"
-graph_col = None
-for col in range(1, ws_win32.UsedRange.Columns.Count + 1):
-    if ws_win32.Cells(1, col).Value == 'GRAPH':
-        graph_col = col
-        break
-
-if graph_col is None:
-    raise ValueError("The column 'GRAPH' was not found in the Excel sheet.")
-
-for pic_path, row_idx in plot_filenames:
-    # Verify that the image file exists
-    if not os.path.exists(pic_path):
-        print(f"File not found: {pic_path}")
-        continue
+    plot_filename = None
+    if plot_dir is not None:
+        plot_filename = os.path.join(plot_dir, f'{drug_name}_ic50_curve.png')
+        draw_curves(curves, drug_name, plot_filename, dpi=dpi)
     
-    # Debug statements
-    print(f"Inserting image: {pic_path}")
-    print(f"Row index: {row_idx}")
+    return {
+        'plot_filename': plot_filename,
+        'cell_lines': cell_lines,
+        'ic50_values': ic50_values,
+        'dss_values': dss_values,
+        'ic50_calc_values': ic50_calc_values,
+        'fit_params': fit_params,
+        'fit_evaluations': fit_evaluations,
+        'fit_stats': fit_stats,
+        'ic50_intervals': ic50_intervals,
+        'curves': curves
+    }
 
-    # Set row height
-    ws_win32.Rows(row_idx).RowHeight = 120  # Adjust as needed
-    
-    left = ws_win32.Cells(row_idx, graph_col).Left
-    top = ws_win32.Cells(row_idx, graph_col).Top
-    col_width = ws_win32.Columns(graph_col).ColumnWidth * 7.5  # Approximate width in points
-    img_width, img_height = plt.imread(pic_path).shape[1], plt.imread(pic_path).shape[0]
-    aspect_ratio = img_width / img_height
-    width = col_width
-    height = width / aspect_ratio
-
-    if height > ws_win32.Rows(row_idx).RowHeight:
-        height = ws_win32.Rows(row_idx).RowHeight
-        width = height * aspect_ratio
-    
-    print(f"Position: left={left}, top={top}, width={width}, height={height}")
-    
-    ws_win32.Shapes.AddPicture(pic_path, LinkToFile=False, SaveWithDocument=True, Left=left, Top=top, Width=width, Height=height)
+# Draw PNGs on demand from the fit parameters and data points kept in the result store
+def render_stored_plots(drug_names=None, config=None):
+    config = dict(default_config(), **(config or {}))
+    render_stored_curve_plots(draw_curves, config['result_store_path'], config['output_dir'], config['plot_dpi'], keys=drug_names)
+
+# Read the R-pipeline table of each cell line into one DataFrame with a 'Cell_Line' column
+def load_cell_lines(file_paths):
+    # Load data from each file into a dictionary of DataFrames
+    data_frames = {}
+    for cell_line, path in file_paths.items():
+        df = read_excel_cached(path)
+        df['Cell_Line'] = cell_line  # Add a column to identify the cell line
+        data_frames[cell_line] = df
+
+    # Combine the data into a single DataFrame
+    return usable_rows(pd.concat(data_frames.values(), ignore_index=True))
+
+# The columns and rows of R-pipeline data (with its 'Cell_Line' column) that the fit can use
+def usable_rows(data):
+    # Extract relevant columns, assuming the column 'Cell_Line' identifies different cell lines
+    data = data[['ID', 'DRUG_NAME', 'Cell_Line', 'D1', 'D2', 'D3', 'D4', 'D5', 'IC50', 'DSS', 'SLOPE', 'MAX', 'MIN', 'Max.Conc.tested']]
+
+    # Remove rows with inf or NaN values in the columns the fit needs
+    # Missing or bad R-pipeline starting values are replaced by data-driven guesses in fit_hill_batch
+    return data.replace([np.inf, -np.inf], np.nan).dropna(subset=['ID', 'DRUG_NAME', 'D1', 'D2', 'D3', 'D4', 'D5', 'Max.Conc.tested'])
+
+# One cell line's rows of a chunk, laid out as load_cell_lines returns them
+def cell_line_rows(rows, cell_line):
+    return usable_rows(rows.assign(Cell_Line=cell_line))
+
+# Yield the rows load_cell_lines would return in chunks of whole drugs, sized to the memory budget
+# Each chunk reads only its drugs' rows from the Parquet sidecars of the workbooks
+def iter_cell_line_chunks(file_paths, memory_budget_mb):
+    sources = [(scan_path(path), 'DRUG_NAME', partial(cell_line_rows, cell_line=cell_line)) for cell_line, path in file_paths.items()]
+    return iter_source_chunks(sources, memory_budget_mb)
+
+# Fit the Hill equation to every (drug, cell line, replicate) row in one batched call
+# Returns a copy of data with IC50_calc, SLOPE_calc, MIN_calc, MAX_calc columns and the fit statistics
+# FIT_EVALS, FIT_STATUS, FIT_R2, FIT_RMSE and FIT_SECONDS
+# FIT_STATUS is converged, early_exit (stopped after 50 iterations without progress), out_of_range
+# (IC50 more than 3 decades outside the tested concentrations, reported as NaN), failed or skipped
+def fit_cell_line_curves(data, max_iter=fit_settings['max_iter']):
+    data = data.copy()
+    concentrations_tested = data['Max.Conc.tested'].to_numpy(dtype=float)[:, None] / dilutions
+    responses = data[['D1', 'D2', 'D3', 'D4', 'D5']].to_numpy(dtype=float)
+    start = perf_counter()
+    ic50_calc, slope_calc, min_calc, max_calc, fit_evaluations, early_exit = fit_hill_batch(
+        concentrations_tested,
+        responses,
+        data[['IC50', 'SLOPE', 'MIN', 'MAX']].to_numpy(dtype=float),  # Initial guesses for curve fitting
+        max_iter=max_iter
+    )
+    seconds = perf_counter() - start
+    # An IC50 this far outside the tested range is not identifiable from the data, so it is not reported
+    log_range = np.log10(concentrations_tested)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_ic50 = np.log10(ic50_calc)
+    out_of_range = early_exit & ((log_ic50 < log_range.min(axis=1) - 3) | (log_ic50 > log_range.max(axis=1) + 3))
+    for values in (ic50_calc, slope_calc, min_calc, max_calc):
+        values[out_of_range] = np.nan
+    data['IC50_calc'] = ic50_calc
+    data['SLOPE_calc'] = slope_calc
+    data['MIN_calc'] = min_calc
+    data['MAX_calc'] = max_calc
+    data['FIT_EVALS'] = fit_evaluations
+    # Rows without a usable response are never iterated; the others converged, stopped early or gave up
+    data['FIT_STATUS'] = np.select(
+        [out_of_range, early_exit, np.isfinite(ic50_calc), fit_evaluations > 0],
+        ['out_of_range', 'early_exit', 'converged', 'failed'], 'skipped')
+    predicted = hill_equation(concentrations_tested, ic50_calc[:, None], slope_calc[:, None], min_calc[:, None], max_calc[:, None])
+    data['FIT_R2'], data['FIT_RMSE'] = fit_quality(responses, predicted)
+    # The rows are fitted together, so each row's time is its share of the model evaluations
+    data['FIT_SECONDS'] = seconds * fit_evaluations / max(np.sum(fit_evaluations), 1)
+    return data
+
+# Covariance and bootstrap IC50 interval columns added by add_ic50_intervals, and their summary names
+interval_columns = ['IC50_CI_LOW', 'IC50_CI_HIGH', 'IC50_BOOT_LOW', 'IC50_BOOT_HIGH']
+interval_summary_columns = ['IC50_calc CI low', 'IC50_calc CI high', 'IC50_calc bootstrap low', 'IC50_calc bootstrap high']
+
+# Add the IC50 confidence interval columns (interval_columns) to fitted data as returned by fit_cell_line_curves
+# The bootstrap columns are NaN when n_samples is 0
+def add_ic50_intervals(data, level, n_samples, seed=0, n_workers=1, max_iter=fit_settings['max_iter']):
+    data = data.copy()
+    concentrations_tested = data['Max.Conc.tested'].to_numpy(dtype=float)[:, None] / dilutions
+    responses = data[['D1', 'D2', 'D3', 'D4', 'D5']].to_numpy(dtype=float)
+    params = data[['IC50_calc', 'SLOPE_calc', 'MIN_calc', 'MAX_calc']].to_numpy(dtype=float)
+    data['IC50_CI_LOW'], data['IC50_CI_HIGH'] = covariance_ic50_interval(concentrations_tested, responses, params, level)
+    # Each curve's resamples are seeded by its drug, cell line and ID, so reruns and chunked runs agree
+    keys = (data['DRUG_NAME'].astype(str) + '|' + data['Cell_Line'].astype(str) + '|' + data['ID'].astype(str)).tolist()
+    data['IC50_BOOT_LOW'], data['IC50_BOOT_HIGH'] = bootstrap_ic50_interval(
+        concentrations_tested, responses, params, keys, n_samples=n_samples, level=level, seed=seed, max_iter=max_iter, n_workers=n_workers)
+    return data
+
+# One summary row per drug: IC50, DSS and calculated IC50 for each cell line, and the plot path
+# confidence_intervals=True adds the interval bounds of the calculated IC50s
+def summary_table(results, cell_lines, confidence_intervals=False):
+    fields = ['IC50', 'DSS', 'IC50_calc'] + (interval_summary_columns if confidence_intervals else [])
+    rows = []
+    for drug, result in results.items():
+        # A drug tested more than once in a cell line reports its first row for that cell line
+        values = {}
+        for i, cell_line in reversed(list(enumerate(result['cell_lines']))):
+            values[cell_line] = (result['ic50_values'][i], result['dss_values'][i], result['ic50_calc_values'][i], *result['ic50_intervals'][i])
+        missing = (np.nan,) * (3 + len(interval_columns))
+        row = {'Drug Name': drug}
+        for field, column in enumerate(fields):
+            for cell_line in cell_lines:
+                row[f'{cell_line} {column}'] = values.get(cell_line, missing)[field]
+        row['GRAPH'] = result['plot_filename']
+        rows.append(row)
+    columns = ['Drug Name'] + [f'{cell_line} {column}' for column in fields for cell_line in cell_lines] + ['GRAPH']
+    return pd.DataFrame(rows, columns=columns)
+
+# Fit, plot and summarize every drug in data (as returned by load_cell_lines)
+# PNGs are only drawn into an output_dir and results only stored in a result_store_path given in config
+# Stage timings and per-fit statistics are added to report when one is given
+# A caller that summarizes in chunks passes the ResultStoreWriter that collects the results of every chunk
+def summarize_cell_lines(data, cell_lines=None, config=None, report=None, store_writer=None):
+    config = dict(default_config(), **(config or {}))
+    report = report or RunReport('cell lines')
+    if cell_lines is None:
+        cell_lines = list(data['Cell_Line'].unique())
+    plot_dir = config['output_dir'] if plots_rendered(config) else None
+
+    # Create output directory for plots
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    # The data is partitioned by drug once instead of masking the full table per drug
+    drug_partitions = partition_frame(data, 'DRUG_NAME')
+    unique_drugs = [drug for drug, _ in drug_partitions]
+
+    # Reuse stored results for drugs whose input rows are unchanged since the last run
+    with report.stage('lookup', len(unique_drugs)):
+        incremental = config['incremental'] and config['result_store_path'] is not None
+        store = load_result_store(config['result_store_path'], keys=unique_drugs) if incremental else {}
+        hash_settings = dict(fit_settings, render_plots=plot_dir is not None, plot_dpi=config['plot_dpi'],
+                             plot_dir=plot_dir, result_version=result_version, confidence_level=config['confidence_level'],
+                             bootstrap_samples=config['bootstrap_samples'], bootstrap_seed=config['bootstrap_seed'])
+        input_hashes = {drug: input_hash(drug_data, hash_settings) for drug, drug_data in drug_partitions}
+        results = {drug: cached_result(store, drug, input_hashes[drug]) for drug in unique_drugs}
+        changed_partitions = [drug_data for drug, drug_data in drug_partitions if results[drug] is None]
+    logger.info("Fitting %d of %d drugs, reusing stored results for the rest", len(changed_partitions), len(unique_drugs))
+    changed_drugs = []
+
+    if changed_partitions:
+        # Fit every changed row in one batched call
+        changed_data = pd.concat(changed_partitions)
+        with report.stage('fit', len(changed_data)):
+            changed_data = fit_cell_line_curves(changed_data, max_iter=fit_settings['max_iter'])
+        fit_evaluations = changed_data['FIT_EVALS'].to_numpy()
+        logger.info("Model evaluations per fit: median %.0f, max %d", np.median(fit_evaluations), np.max(fit_evaluations, initial=0))
+        if config['confidence_level'] is not None:
+            with report.stage('confidence_intervals', len(changed_data) * max(config['bootstrap_samples'], 1)):
+                changed_data = add_ic50_intervals(changed_data, config['confidence_level'], config['bootstrap_samples'],
+                                                  seed=config['bootstrap_seed'], n_workers=config['n_workers'])
+
+        # Generate plots for each changed drug
+        # Each drug is plotted independently; map() hands the results back in the original drug order
+        fitted_partitions = partition_frame(changed_data, 'DRUG_NAME')
+        changed_drugs = [drug for drug, _ in fitted_partitions]
+        drug_data_list = [drug_data for _, drug_data in fitted_partitions]
+        plot_drug = partial(plot_ic50_curve, plot_dir=plot_dir, dpi=config['plot_dpi'])
+        with report.stage('plot', len(changed_drugs)):
+            if config['n_workers'] > 1 and len(changed_drugs) > 1:
+                with ProcessPoolExecutor(max_workers=config['n_workers']) as executor:
+                    chunksize = max(1, len(changed_drugs) // (config['n_workers'] * 4))
+                    rendered = list(executor.map(plot_drug, drug_data_list, changed_drugs, chunksize=chunksize))
+            else:
+                rendered = list(map(plot_drug, drug_data_list, changed_drugs))
+
+        results.update(zip(changed_drugs, rendered))
+
+    # Per-fit statistics of every drug in this run; reused drugs report the statistics of the run that fitted them
+    fitted_now = set(changed_drugs)
+    report.add_fits(dict(stats, key=drug, cached=drug not in fitted_now) for drug in unique_drugs for stats in results[drug]['fit_stats'])
+
+    # Keep exactly the drugs of this run in the store, if there is one
+    if store_writer is not None or config['result_store_path'] is not None:
+        with report.stage('store', len(unique_drugs)):
+            writer = store_writer or ResultStoreWriter(config['result_store_path'])
+            for drug in unique_drugs:
+                writer.add(drug, input_hashes[drug], results[drug])
+            if store_writer is None:
+                writer.close()
+
+    return summary_table(results, cell_lines, confidence_intervals=config['confidence_level'] is not None)
+
+# Run the whole pipeline for one screen; config overrides the defaults at the top of this file
+def main(config=None):
+    config = output_paths(dict(default_config(), **(config or {})))
+    report = RunReport('cell lines')
+    cell_lines = list(config['file_paths'])
+    return run_curve_pipeline(config, report,
+                              load_data=partial(load_cell_lines, config['file_paths']),
+                              iter_data_chunks=partial(iter_cell_line_chunks, config['file_paths'], config['memory_budget_mb']),
+                              summarize=partial(summarize_cell_lines, cell_lines=cell_lines, config=config, report=report),
+                              sheet_title="IC50 Summary", model='hill')
 
-wb_win32.Save()
-wb_win32.Close()
-Excel.Quit()
+if __name__ == '__main__':
+    # Define the base directory and file paths for the four Excel files
+    base_dir = r'C:\Users\kun.qian\Desktop\Projects\Nordic Oncology Library\screening test\FiMMs comparison\python combined dose curves\four cell lines'
+    configure_logging()
+    main({
+        'file_paths': {
+            'HL60': os.path.join(base_dir, 'HL60_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
+            'Kuramochi': os.path.join(base_dir, 'Kuramochi_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
+            'MOLM13': os.path.join(base_dir, 'MOLM13_DSRT_analysis_table_Rpipeline_IC50.xlsx'),
+            'Ovcar8': os.path.join(base_dir, 'Ovcar8_DSRT_analysis_table_Rpipeline_IC50.xlsx')
+        },
+        'output_dir': os.path.join(base_dir, 'ic50_plots'),
+        'excel_path': os.path.join(base_dir, 'IC50_summary_with_plots.xlsx'),
+        'n_workers': os.cpu_count(),
+        'result_store_path': os.path.join(base_dir, 'IC50_fit_store.tsv')
+    })
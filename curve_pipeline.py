@@ -0,0 +1,82 @@
+import os
+from chunked_store import ColumnarChunkWriter, iter_chunks
+from html_report import write_html_report
+from result_store import ResultStoreWriter, iter_result_store
+from summary_workbook import write_summary_workbook, write_summary_workbook_streaming
+
+# Summary outputs of the curve scripts: 'xlsx' is the workbook with the PNGs embedded in its GRAPH column,
+# 'html' one sortable page (<summary workbook>.html) that draws the curves from the result store as it scrolls
+output_formats = ('xlsx', 'html', 'both')
+
+
+# render_plots, or when it is None whether the summary is not html-only, as the HTML report draws its own curves
+def plots_rendered(config):
+    return config['output_format'] != 'html' if config['render_plots'] is None else config['render_plots']
+
+
+# main() settings with the summary outputs located: excel_path is required, and without a result_store_path the
+# fitted results go to <summary workbook>_fit_store.tsv, which the HTML report and incremental reruns read
+def output_paths(config):
+    if config['excel_path'] is None:
+        raise ValueError("No excel_path given for the summary outputs")
+    if config['result_store_path'] is None:
+        config = dict(config, result_store_path=os.path.splitext(config['excel_path'])[0] + '_fit_store.tsv')
+    return config
+
+
+# Draw the PNGs of the stored results (all, or those of keys) from their fit parameters and data points
+def render_stored_plots(draw_curves, result_store_path, plot_dir, dpi, keys=None):
+    wanted = None if keys is None else {str(key) for key in keys}
+    os.makedirs(plot_dir, exist_ok=True)
+    with ResultStoreWriter(result_store_path) as store_writer:
+        for key, entry in iter_result_store(result_store_path):
+            if wanted is None or key in wanted:
+                plot_filename = os.path.join(plot_dir, f'{key}_ic50_curve.png')
+                draw_curves(entry['result']['curves'], key, plot_filename, dpi=dpi)
+                entry['result']['plot_filename'] = plot_filename
+            store_writer.add(key, entry['hash'], entry['result'])
+
+
+# Fit, plot and summarize one screen, then write its summary outputs and run report
+# load_data() returns the whole screen; with a memory_budget_mb, iter_data_chunks() yields it in chunks of whole drugs
+# or batches instead and the summary goes through <summary workbook>_summary.parquet
+# summarize(data, store_writer=...) is the script's summarize function, model the html_report curve model
+# Returns the summary DataFrame, or the path of the Parquet summary of a chunked run
+def run_curve_pipeline(config, report, load_data, iter_data_chunks, summarize, sheet_title, model):
+    if config['output_format'] not in output_formats:
+        raise ValueError(f"Unknown output format: {config['output_format']} (expected one of {output_formats})")
+    base_path = os.path.splitext(config['excel_path'])[0]
+    if config['memory_budget_mb'] is None:
+        with report.stage('load'):
+            data = load_data()
+        summary = summarize(data)
+        rows = len(summary)
+    else:
+        summary, rows = _summarize_chunked(config, report, iter_data_chunks(), summarize, base_path + '_summary.parquet')
+
+    if config['output_format'] in ('xlsx', 'both'):
+        with report.stage('workbook', rows):
+            if isinstance(summary, str):
+                write_summary_workbook_streaming(iter_chunks(summary), config['excel_path'], sheet_title)
+            else:
+                write_summary_workbook(summary, config['excel_path'], sheet_title)
+    if config['output_format'] in ('html', 'both'):
+        with report.stage('html_report', rows):
+            summaries = iter_chunks(summary) if isinstance(summary, str) else [summary]
+            write_html_report(summaries, config['result_store_path'], base_path + '.html', sheet_title, model)
+    if config['run_report']:
+        report.write(base_path + '_run_report')
+    return summary
+
+
+# Summarize chunk by chunk into a Parquet store; every chunk looks up its own entries of the previous result store
+# and adds them to the new one, which replaces the previous store once all chunks are done
+def _summarize_chunked(config, report, chunks, summarize, summary_path):
+    with ColumnarChunkWriter(summary_path) as writer, ResultStoreWriter(config['result_store_path']) as store_writer:
+        while True:
+            with report.stage('load'):
+                data = next(chunks, None)
+            if data is None:
+                break
+            writer.append(summarize(data, store_writer=store_writer))
+    return summary_path, writer.rows
@@ -0,0 +1,74 @@
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+# One reusable Agg figure for drawing dose-response plots: the figure, axes and line artists are created once and only
+# their data is replaced for every plot, without per-plot figure setup or a tight-bbox layout pass
+# Each series is a fitted curve plus its measured points, drawn in the next color of the axes property cycle
+class CurveRenderer:
+    def __init__(self, figsize=(6, 4), dpi=100, markersize=6):
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        # Fixed margins instead of bbox_inches='tight'
+        self.figure.subplots_adjust(left=0.12, right=0.96, bottom=0.13, top=0.91)
+        self.ax = self.figure.add_subplot()
+        self.ax.set_xscale('log')
+        self.ax.set_xlabel('Concentration')
+        self.ax.set_ylabel('Response')
+        self.ax.grid(True)
+        self.colors = rcParams['axes.prop_cycle'].by_key()['color']
+        self.markersize = markersize
+        self.curve_lines = []
+        self.point_lines = []
+
+    def _ensure_artists(self, count):
+        while len(self.curve_lines) < count:
+            color = self.colors[len(self.curve_lines) % len(self.colors)]
+            curve, = self.ax.plot([], [], color=color)
+            points, = self.ax.plot([], [], linestyle='none', marker='o', markersize=self.markersize, color=color, zorder=5)
+            self.curve_lines.append(curve)
+            self.point_lines.append(points)
+
+    # Draw series of (label, curve_x, curve_y, points_x, points_y) tuples and save a PNG
+    def render(self, plot_filename, title, series):
+        self._ensure_artists(len(series))
+        for i, (curve, points) in enumerate(zip(self.curve_lines, self.point_lines)):
+            visible = i < len(series)
+            if visible:
+                label, curve_x, curve_y, points_x, points_y = series[i]
+                curve.set_data(curve_x, curve_y)
+                curve.set_label(label)
+                points.set_data(points_x, points_y)
+            curve.set_visible(visible)
+            points.set_visible(visible)
+
+        self.ax.set_title(title)
+        self.ax.relim(visible_only=True)
+        self.ax.autoscale_view()
+        legend = self.ax.get_legend()
+        if legend is not None:
+            legend.remove()
+        if series:
+            self.ax.legend(handles=self.curve_lines[:len(series)])
+        self.figure.savefig(plot_filename)
+
+
+# One renderer per process and layout, created on first use (each pool worker gets its own)
+_renderers = {}
+
+
+def shared_renderer(figsize=(6, 4), dpi=100, markersize=6):
+    key = (tuple(figsize), dpi, markersize)
+    if key not in _renderers:
+        _renderers[key] = CurveRenderer(figsize=figsize, dpi=dpi, markersize=markersize)
+    return _renderers[key]
+
+
+# Log-spaced points across the tested range, for drawing a fitted curve on a log axis
+# Zero (vehicle) concentrations cannot be placed on that axis and are left out
+def smooth_concentrations(concentrations, num=100):
+    concentrations = np.asarray(concentrations, dtype=float)
+    concentrations = concentrations[concentrations > 0]
+    return np.logspace(np.log10(concentrations.min()), np.log10(concentrations.max()), num)
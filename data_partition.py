@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+
+# Split frame into (key, slice) pairs for every distinct value of column, keys in frame[column].unique() order
+# One stable sort on the first-appearance codes keeps each key's rows in their original order, and every part is a
+# positional slice of the sorted frame instead of a boolean-mask scan over the whole table
+def partition_frame(frame, column):
+    codes, keys = pd.factorize(frame[column], sort=False)
+    order = np.argsort(codes, kind='stable')
+    sorted_frame = frame.take(order)
+    sorted_codes = codes[order]
+
+    # Rows with a missing key (code -1) sort first and are left out, as with a mask
+    bounds = np.searchsorted(sorted_codes, np.arange(len(keys) + 1))
+    return [(key, sorted_frame.iloc[bounds[i]:bounds[i + 1]]) for i, key in enumerate(keys)]
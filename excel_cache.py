@@ -0,0 +1,61 @@
+import hashlib
+import os
+import pandas as pd
+
+# Sidecar files live in a hidden folder next to the workbook they were converted from
+cache_dir_name = '.excel_cache'
+
+# Rows per Parquet row group, so a sidecar can be scanned a bounded slice at a time (see chunked_store)
+sidecar_row_group_rows = 50000
+
+
+# The key covers the file identity (path, size, mtime) and the read_excel options used
+def _sidecar_path(path, read_kwargs):
+    stat = os.stat(path)
+    key = repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, sorted(read_kwargs.items())))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), cache_dir_name)
+    return cache_dir, f"{os.path.basename(path)}-{digest}.parquet"
+
+
+# pd.read_excel with a Parquet sidecar that later reads memory-map until the workbook's path, size or modification
+# time changes; without pyarrow, or for a sheet Parquet cannot store (mixed-type columns), it is a plain read
+def read_excel_cached(path, **read_kwargs):
+    cache_dir, sidecar_name = _sidecar_path(path, read_kwargs)
+    sidecar = os.path.join(cache_dir, sidecar_name)
+
+    if os.path.exists(sidecar):
+        try:
+            return pd.read_parquet(sidecar, memory_map=True)
+        except (ImportError, OSError, ValueError):
+            pass
+
+    df = pd.read_excel(path, **read_kwargs)
+    _write_sidecar(df, path, cache_dir, sidecar_name)
+    return df
+
+
+# Path of the Parquet sidecar of a workbook, converting the workbook first if needed; None if it cannot be stored as Parquet
+def excel_parquet_path(path, **read_kwargs):
+    cache_dir, sidecar_name = _sidecar_path(path, read_kwargs)
+    sidecar = os.path.join(cache_dir, sidecar_name)
+    if not os.path.exists(sidecar):
+        _write_sidecar(pd.read_excel(path, **read_kwargs), path, cache_dir, sidecar_name)
+    return sidecar if os.path.exists(sidecar) else None
+
+
+# Store df as the Parquet sidecar of the workbook at path; a sheet that cannot be stored as Parquet is left uncached
+def _write_sidecar(df, path, cache_dir, sidecar_name):
+    sidecar = os.path.join(cache_dir, sidecar_name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Drop sidecars left over from older versions of the same workbook
+        prefix = os.path.basename(path) + '-'
+        for old in os.listdir(cache_dir):
+            if old.startswith(prefix) and old.endswith('.parquet') and old != sidecar_name:
+                os.remove(os.path.join(cache_dir, old))
+        df.to_parquet(sidecar + '.tmp', index=False, row_group_size=sidecar_row_group_rows)
+        os.replace(sidecar + '.tmp', sidecar)
+    except (ImportError, OSError, ValueError, TypeError, NotImplementedError):
+        if os.path.exists(sidecar + '.tmp'):
+            os.remove(sidecar + '.tmp')
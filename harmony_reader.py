@@ -0,0 +1,58 @@
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pandas as pd
+
+# The data block is parsed by pandas' pyarrow engine when pyarrow is installed, otherwise by its C engine;
+# with one column kept out of dozens, pyarrow's parser is about three times faster on Harmony exports
+csv_engine = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+# Measurement column the BREEZE table is built from
+signal_column = 'Cell Selected - Number of Objects'
+
+# Header line (0-based) holding the plate barcode as its second tab-separated field
+barcode_line = 3
+
+# Exports parsed at once by read_harmony_exports; a plate is mostly waiting on the disk or network share
+reader_threads = 8
+
+
+# The Harmony TXT exports of a folder, in file name order
+def harmony_export_paths(input_folder):
+    return [os.path.join(input_folder, f) for f in sorted(os.listdir(input_folder)) if f.endswith('.txt')]
+
+
+# Consume the header block of an export opened in binary mode, up to the column header line; returns the barcode
+def read_harmony_header(txt_file, row_start):
+    barcode = None
+    for line_nr in range(row_start - 1):
+        line = txt_file.readline()
+        if line_nr == barcode_line:
+            barcode = line.decode('utf-8').strip().split('\t')[1]
+    return barcode
+
+
+# Only the barcode from the header of a Harmony TXT export
+def read_harmony_barcode(txt_path):
+    with open(txt_path, 'rb') as txt_file:
+        return read_harmony_header(txt_file, barcode_line + 2)
+
+
+# Barcode and the requested measurement columns of one Harmony TXT export
+# Only the header lines before row_start are read line by line; the data block is parsed by a native CSV parser
+# (csv_engine) straight from the open file, keeping just columns with their inferred numeric dtypes
+def read_harmony_export(txt_path, row_start, columns=(signal_column,)):
+    with open(txt_path, 'rb') as txt_file:
+        barcode = read_harmony_header(txt_file, row_start)
+        data = pd.read_csv(txt_file, sep='\t', usecols=list(columns), engine=csv_engine)
+    return barcode, data
+
+
+# read_harmony_export for many files on a thread pool; results come back in the order of txt_paths
+def read_harmony_exports(txt_paths, row_start, columns=(signal_column,), n_threads=reader_threads):
+    read_export = partial(read_harmony_export, row_start=row_start, columns=columns)
+    if n_threads > 1 and len(txt_paths) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            return list(executor.map(read_export, txt_paths))
+    return [read_export(txt_path) for txt_path in txt_paths]
@@ -0,0 +1,156 @@
+import numpy as np
+from scipy.special import expit
+
+
+# Hill equation evaluated in log space for a whole batch of rows at once.
+# theta columns: log(IC50), hill slope, min response, max response
+def _hill_batch(log_conc, theta):
+    z = theta[:, 1:2] * (log_conc - theta[:, 0:1])
+    return theta[:, 2:3] + (theta[:, 3:4] - theta[:, 2:3]) * expit(-z), z
+
+
+# Closed-form Jacobian of _hill_batch with respect to theta, shape (rows, points, 4)
+def _hill_batch_jacobian(log_conc, theta, z):
+    lower = expit(-z)   # 1 / (1 + (c / ic50)^h)
+    upper = expit(z)    # (c / ic50)^h / (1 + (c / ic50)^h)
+    span = (theta[:, 3:4] - theta[:, 2:3]) * lower * upper
+    return np.stack([
+        span * theta[:, 1:2],
+        -span * (log_conc - theta[:, 0:1]),
+        upper,
+        lower,
+    ], axis=-1)
+
+
+# Data-driven IC50, slope, min and max starting values for every row: plateaus at the extreme responses, ordered by
+# whether the response falls or rises (the slope stays non-negative, so a rising curve has min_resp above max_resp),
+# and the IC50 at the tested concentration whose response is closest to the midpoint between them
+def hill_initial_guesses(concentrations, responses):
+    concentrations = np.broadcast_to(np.asarray(concentrations, dtype=float), np.shape(responses))
+    responses = np.asarray(responses, dtype=float)
+    low, high = np.nanmin(responses, axis=1), np.nanmax(responses, axis=1)
+    order = np.argsort(concentrations, axis=1)
+    first = np.take_along_axis(responses, order[:, :1], axis=1)[:, 0]
+    last = np.take_along_axis(responses, order[:, -1:], axis=1)[:, 0]
+    falling = last <= first
+
+    max_resp = np.clip(np.where(falling, high, low), 0, None)
+    min_resp = np.clip(np.where(falling, low, high), 0, None)
+    midpoint = np.abs(responses - ((low + high) / 2)[:, None])
+    midpoint[np.isnan(midpoint)] = np.inf
+    ic50 = np.take_along_axis(concentrations, np.argmin(midpoint, axis=1)[:, None], axis=1)[:, 0]
+    return np.column_stack([ic50, np.ones_like(ic50), min_resp, max_resp])
+
+
+# Fit hill_equation to every row of (rows, points) responses in one vectorized Levenberg-Marquardt run
+# initial_guesses is (rows, 4) as IC50, slope, min, max; unusable guesses start from hill_initial_guesses, and all
+# parameters stay non-negative as with the bounds=(0, inf) of the per-row curve_fit
+# Returns IC50, slope, min and max arrays, the model evaluations per row and an early-exit mask. Rows with non-finite
+# data, a flat response or no convergence within max_iter iterations are NaN; rows stopped early (almost no gain over
+# 50 iterations, or an IC50 more than 3 decades outside the tested range) keep their last parameters and are flagged
+def fit_hill_batch(concentrations, responses, initial_guesses, max_iter=2000, ftol=1e-8, xtol=1e-8, gtol=1e-8):
+    concentrations = np.asarray(concentrations, dtype=float)
+    responses = np.asarray(responses, dtype=float)
+    initial_guesses = np.array(initial_guesses, dtype=float)
+    n_rows = responses.shape[0]
+
+    log_conc = np.log(np.clip(np.broadcast_to(concentrations, responses.shape), 1e-10, np.inf))
+    theta = np.full((n_rows, 4), np.nan)
+    evaluations = np.zeros(n_rows, dtype=int)
+
+    finite = np.isfinite(responses).all(axis=1) & np.isfinite(log_conc).all(axis=1)
+
+    # Fall back to data-driven starting values where the supplied guess is unusable; rows with non-finite data are
+    # never fitted, so they get no guess either
+    bad_guess = (~np.isfinite(initial_guesses).all(axis=1) | (initial_guesses < 0).any(axis=1)
+                 | (initial_guesses[:, 0] <= 0))
+    fill = bad_guess & finite
+    if fill.any():
+        initial_guesses[fill] = hill_initial_guesses(np.broadcast_to(concentrations, responses.shape)[fill], responses[fill])
+
+    # Early exit: rows with non-finite data or a flat response are not iterated at all
+    spread = np.ptp(np.where(finite[:, None], responses, 0), axis=1)
+    scale = np.max(np.abs(np.where(finite[:, None], responses, 0)), axis=1)
+    feasible = (finite & (spread > 1e-9 * np.maximum(scale, 1))
+                & np.isfinite(initial_guesses).all(axis=1) & (initial_guesses >= 0).all(axis=1)
+                & (initial_guesses[:, 0] > 0))
+    theta[feasible] = initial_guesses[feasible]
+    theta[feasible, 0] = np.log(initial_guesses[feasible, 0])
+
+    converged = np.zeros(n_rows, dtype=bool)
+    early_exit = np.zeros(n_rows, dtype=bool)
+    damping = np.full(n_rows, 1e-3)
+    active = np.flatnonzero(feasible)
+
+    fitted, z = _hill_batch(log_conc[active], theta[active])
+    cost = np.sum((responses[active] - fitted) ** 2, axis=1)
+    evaluations[active] += 1
+
+    checkpoint = cost.copy()
+
+    for iteration in range(1, max_iter + 1):
+        if active.size == 0:
+            break
+        evaluations[active] += 1
+        x, y, th = log_conc[active], responses[active], theta[active]
+        residuals = y - fitted
+        jac = _hill_batch_jacobian(x, th, z)
+        gradient = np.einsum('rpi,rp->ri', jac, residuals)
+
+        # Freeze parameters that sit on their lower bound and are being pushed through it
+        frozen = np.zeros_like(th, dtype=bool)
+        frozen[:, 1:] = (th[:, 1:] <= 0) & (gradient[:, 1:] < 0)
+        jac[np.broadcast_to(frozen[:, None, :], jac.shape)] = 0
+        jtj = np.einsum('rpi,rpj->rij', jac, jac)
+        gradient[frozen] = 0
+
+        # Gradient test: residuals already orthogonal to every free Jacobian column
+        scale = np.sqrt(np.einsum('rii->ri', jtj) * cost[:, None])
+        stationary = np.all(np.abs(gradient) <= gtol * scale, axis=1)
+
+        # Marquardt scaling with a floor keeps every system positive definite
+        diag = np.einsum('rii->ri', jtj)
+        diag = np.maximum(diag, 1e-6 * diag.max(axis=1, keepdims=True) + 1e-12)
+        system = jtj + damping[active, None, None] * np.einsum('ri,ij->rij', diag, np.eye(4))
+        step = np.linalg.solve(system, gradient[..., None])[..., 0]
+
+        candidate = th + step
+        candidate[:, 1:] = np.maximum(candidate[:, 1:], 0)
+        candidate_fitted, candidate_z = _hill_batch(x, candidate)
+        candidate_cost = np.sum((y - candidate_fitted) ** 2, axis=1)
+
+        # Steps moving the IC50 by more than a decade or the slope by more than its own size + 1 are rejected, so the
+        # damping grows until the step can be trusted: from a near-flat curve an undamped step can otherwise jump to a
+        # saturated curve whose vanishing gradient passes for convergence
+        trusted = (np.abs(step[:, 0]) <= np.log(10)) & (np.abs(step[:, 1]) <= th[:, 1] + 1)
+        accept = trusted & np.isfinite(candidate_cost) & (candidate_cost <= cost)
+        actual_step = np.linalg.norm(candidate - th, axis=1)
+        done = accept & ((cost - candidate_cost <= ftol * np.maximum(cost, 1e-300))
+                         | (actual_step <= xtol * (np.linalg.norm(th, axis=1) + xtol)))
+
+        theta[active[accept]] = candidate[accept]
+        fitted[accept] = candidate_fitted[accept]
+        z[accept] = candidate_z[accept]
+        cost[accept] = candidate_cost[accept]
+        damping[active] = np.where(accept, np.maximum(damping[active] * 0.3, 1e-7), damping[active] * 10)
+
+        # A row whose damping has blown up is sitting in a minimum (or on a bound)
+        stalled = ~accept & (damping[active] > 1e12)
+        finished = done | stalled | stationary
+
+        # Early exit every 50 steps: a row crawling along a flat valley gains almost nothing,
+        # and an IC50 more than 3 decades outside the tested range is not identifiable anyway
+        if iteration % 50 == 0:
+            outside = ((theta[active, 0] < x.min(axis=1) - 3 * np.log(10))
+                       | (theta[active, 0] > x.max(axis=1) + 3 * np.log(10)))
+            stopped = ~finished & ((checkpoint - cost <= 1e-4 * cost) | outside)
+            early_exit[active[stopped]] = True
+            finished |= stopped
+            checkpoint = cost.copy()
+        converged[active[finished]] = True
+        keep = ~finished
+        active, fitted, z, cost, checkpoint = active[keep], fitted[keep], z[keep], cost[keep], checkpoint[keep]
+
+    theta[~converged] = np.nan
+    theta[:, 0] = np.exp(theta[:, 0])
+    return theta[:, 0], theta[:, 1], theta[:, 2], theta[:, 3], evaluations, early_exit
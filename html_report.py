@@ -0,0 +1,145 @@
+import html
+import json
+import math
+import os
+import numpy as np
+from result_store import load_result_store
+
+# Curve models the report can draw, as JavaScript functions of a concentration and the stored fit parameters
+# hill: hill_equation of the cell-line script (IC50, slope, min, max); logistic: logistic_model of the time-point script (A, B, C, D)
+curve_models = {
+    'hill': '(c, p) => p[2] + (p[3] - p[2]) / (1 + Math.pow(Math.max(c, 1e-10) / p[0], p[1]))',
+    'logistic': '(x, p) => p[0] + (p[1] - p[0]) / (1 + Math.pow(p[2] / x, p[3]))'
+}
+
+_style = """
+body { font-family: sans-serif; font-size: 13px; margin: 1em; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #ccc; padding: 2px 6px; text-align: right; white-space: nowrap; }
+th { position: sticky; top: 0; background: #eee; cursor: pointer; user-select: none; }
+th.asc::after { content: ' \\25B2'; } th.desc::after { content: ' \\25BC'; }
+td:first-child { text-align: left; }
+td.graph { width: 260px; height: 186px; padding: 0; text-align: left; vertical-align: top; }
+.legend { font-size: 10px; line-height: 1.2; white-space: normal; }
+"""
+
+_script = """
+const model = MODEL;
+const colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+const W = 260, H = 150, L = 40, R = 6, T = 6, B = 16;
+const escape = text => String(text).replace(/[&<>"]/g, ch => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})[ch]);
+
+// Fitted curves (60 log-spaced points each) and measured points of one row as an inline SVG
+function draw(td) {
+  const curves = JSON.parse(td.dataset.curves);
+  if (!curves.length) return;
+  const all = curves.flatMap(c => c.x).filter(x => x > 0);
+  const lo = Math.log10(Math.min(...all)), hi = Math.log10(Math.max(...all)), span = (hi - lo) || 1;
+  const lines = curves.map(c => {
+    const x = c.x.filter(v => v > 0), a = Math.log10(Math.min(...x)), b = Math.log10(Math.max(...x));
+    return Array.from({length: 60}, (_, i) => { const u = a + (b - a) * i / 59; return [u, model(Math.pow(10, u), c.p)]; })
+      .filter(point => isFinite(point[1]));
+  });
+  const ys = lines.flat().map(point => point[1]).concat(curves.flatMap(c => c.y)).filter(isFinite);
+  const ymin = Math.min(...ys), ymax = Math.max(...ys), yspan = (ymax - ymin) || 1;
+  const sx = u => (L + (u - lo) / span * (W - L - R)).toFixed(1);
+  const sy = y => (T + (ymax - y) / yspan * (H - T - B)).toFixed(1);
+  let svg = `<svg width="${W}" height="${H}" viewBox="0 0 ${W} ${H}" font-size="9">`;
+  svg += `<rect x="${L}" y="${T}" width="${W - L - R}" height="${H - T - B}" fill="none" stroke="#999"/>`;
+  svg += `<text x="${L - 2}" y="${T + 8}" text-anchor="end">${ymax.toPrecision(3)}</text>`;
+  svg += `<text x="${L - 2}" y="${H - B}" text-anchor="end">${ymin.toPrecision(3)}</text>`;
+  svg += `<text x="${L}" y="${H - 4}">${Math.pow(10, lo).toPrecision(3)}</text>`;
+  svg += `<text x="${W - R}" y="${H - 4}" text-anchor="end">${Math.pow(10, hi).toPrecision(3)}</text>`;
+  curves.forEach((c, i) => {
+    const color = colors[i % colors.length];
+    svg += `<polyline fill="none" stroke="${color}" stroke-width="1.5" points="${lines[i].map(point => sx(point[0]) + ',' + sy(point[1])).join(' ')}"><title>${escape(c.label)}</title></polyline>`;
+    c.x.forEach((x, j) => { if (x > 0 && isFinite(c.y[j])) svg += `<circle cx="${sx(Math.log10(x))}" cy="${sy(c.y[j])}" r="2.5" fill="${color}"/>`; });
+  });
+  svg += '</svg><div class="legend">' + curves.map((c, i) => `<span style="color:${colors[i % colors.length]}">&#9679; ${escape(c.label)}</span>`).join('<br>') + '</div>';
+  td.innerHTML = svg;
+}
+
+// Plots are drawn only when their row scrolls into view
+const observer = new IntersectionObserver(entries => {
+  for (const entry of entries) {
+    if (entry.isIntersecting) { draw(entry.target); observer.unobserve(entry.target); }
+  }
+}, {rootMargin: '400px'});
+document.querySelectorAll('td.graph').forEach(td => observer.observe(td));
+
+// Click a column header to sort by it; numbers sort numerically and empty cells sort last
+document.querySelectorAll('th').forEach((th, column) => th.addEventListener('click', () => {
+  const tbody = document.querySelector('tbody');
+  const ascending = !th.classList.contains('asc');
+  document.querySelectorAll('th').forEach(other => other.classList.remove('asc', 'desc'));
+  th.classList.add(ascending ? 'asc' : 'desc');
+  const key = row => {
+    const value = row.children[column].dataset.sort;
+    return value === undefined || value === '' ? null : (isNaN(Number(value)) ? value : Number(value));
+  };
+  const rows = Array.from(tbody.rows).map(row => [key(row), row]);
+  rows.sort((a, b) => {
+    if (a[0] === null || b[0] === null) return (a[0] === null) - (b[0] === null);
+    const order = typeof a[0] === typeof b[0] ? (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : 0) : String(a[0]).localeCompare(String(b[0]));
+    return ascending ? order : -order;
+  });
+  rows.forEach(([, row]) => tbody.appendChild(row));
+}));
+"""
+
+
+# 6 significant digits are plenty for drawing; NaN/inf become null
+def _compact(values):
+    return [float(f'{value:.6g}') if math.isfinite(value) else None for value in np.asarray(values, dtype=float).ravel()]
+
+
+# The cell shows a rounded number; data-sort keeps the full value for sorting
+def _cell(value):
+    if value is None or (isinstance(value, (float, np.floating)) and math.isnan(value)):
+        return '<td></td>'
+    if isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        number = float(value)
+        sort_value = repr(number) if math.isfinite(number) else ('Infinity' if number > 0 else '-Infinity')
+        return f'<td data-sort="{sort_value}">{number:.4g}</td>'
+    text = html.escape(str(value))
+    return f'<td data-sort="{text}">{text}</td>'
+
+
+# Fit parameters and data points of a row's curves, drawn by the page script when the row becomes visible
+def _graph_cell(curves):
+    data = [{'label': curve['label'], 'p': _compact(curve['params']), 'x': _compact(curve['concentrations']),
+             'y': _compact(curve['responses'])} for curve in curves]
+    # Single-quoted attribute, so the JSON's double quotes need no escaping
+    data_json = json.dumps(data, separators=(',', ':')).replace('&', '&amp;').replace('<', '&lt;').replace("'", '&#39;')
+    return f"<td class=\"graph\" data-curves='{data_json}'></td>"
+
+
+# Write summary tables as one sortable HTML page with an inline plot per row, chunk by chunk under a temporary name
+# summaries is an iterable of summary DataFrames (one, or the chunks of a chunked run) with the key (drug or batch) in
+# the first column; each chunk's curves are read from the result store and drawn client-side as SVG with the
+# curve_models[model] function, in place of the GRAPH column
+def write_html_report(summaries, result_store_path, html_path, title, model):
+    if model not in curve_models:
+        raise ValueError(f"Unknown curve model: {model} (expected one of {sorted(curve_models)})")
+    with open(html_path + '.tmp', 'w', encoding='utf-8') as html_file:
+        html_file.write(f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>'
+                        f'<style>{_style}</style></head>\n<body><h2>{html.escape(title)}</h2>\n<table>\n')
+        header_written = False
+        for summary in summaries:
+            columns = [column for column in summary.columns if column != 'GRAPH']
+            if not header_written:
+                html_file.write('<thead><tr>' + ''.join(f'<th>{html.escape(str(column))}</th>' for column in columns)
+                                + '<th>Curves</th></tr></thead>\n<tbody>\n')
+                header_written = True
+            curves = stored_curves(result_store_path, keys=summary[columns[0]])
+            for values in summary[columns].itertuples(index=False, name=None):
+                html_file.write('<tr>' + ''.join(_cell(value) for value in values) + _graph_cell(curves.get(str(values[0]), [])) + '</tr>\n')
+        if not header_written:
+            html_file.write('<tbody>\n')
+        html_file.write('</tbody></table>\n<script>\n' + _script.replace('MODEL', curve_models[model]) + '</script>\n</body></html>\n')
+    os.replace(html_path + '.tmp', html_path)
+
+
+# The curves of the drugs or batches in a result store (all, or those of keys), keyed like the store
+def stored_curves(result_store_path, keys=None):
+    return {key: entry['result']['curves'] for key, entry in load_result_store(result_store_path, keys=keys).items()}
@@ -0,0 +1,103 @@
+import warnings
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+from scipy.stats import t as student_t
+from hill_fitting import _hill_batch, _hill_batch_jacobian, fit_hill_batch
+
+# Bootstrap fits handed to fit_hill_batch at once (rows x resamples); keeps one block to a few tens of MB
+bootstrap_block_fits = 100000
+
+
+# exp(ln IC50 -/+ t * SE): the interval is symmetric in log space, where the IC50 is fitted
+def log_ic50_interval(log_ic50, standard_error, dof, level=0.95):
+    log_ic50, standard_error, dof = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (log_ic50, standard_error, dof)))
+    # Without residual degrees of freedom there is no variance estimate, so no interval
+    t_value = student_t.ppf((1 + level) / 2, np.where(dof > 0, dof, np.nan))
+    half_width = t_value * standard_error
+    # A poorly determined IC50 can have an upper bound beyond float range; it is reported as inf (the text 'inf' in the workbooks)
+    with np.errstate(over='ignore'):
+        return np.exp(log_ic50 - half_width), np.exp(log_ic50 + half_width)
+
+
+# IC50 confidence interval of every row from the covariance of its Hill fit, params being (rows, 4) IC50, slope, min
+# and max as returned by fit_hill_batch. The covariance is s² (JᵀJ)⁻¹ at the fitted parameters with ln(IC50) as the
+# parameter, as curve_fit reports it; rows without a fit, or with no more points than parameters, get NaN
+def covariance_ic50_interval(concentrations, responses, params, level=0.95):
+    responses = np.asarray(responses, dtype=float)
+    concentrations = np.broadcast_to(np.asarray(concentrations, dtype=float), responses.shape)
+    theta = np.array(params, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta[:, 0] = np.log(theta[:, 0])
+    log_conc = np.log(np.clip(concentrations, 1e-10, np.inf))
+    fitted, z = _hill_batch(log_conc, theta)
+    jac = _hill_batch_jacobian(log_conc, theta, z)
+    jtj = np.einsum('rpi,rpj->rij', jac, jac)
+
+    dof = responses.shape[1] - theta.shape[1]
+    residual_variance = np.sum((responses - fitted) ** 2, axis=1) / max(dof, 1)
+    standard_error = np.full(len(theta), np.nan)
+    ok = np.isfinite(theta).all(axis=1) & np.isfinite(jtj).all(axis=(1, 2)) & np.isfinite(residual_variance)
+    if ok.any():
+        # pinv: a parameter sitting on its bound (slope or plateau at 0) can leave JᵀJ singular
+        standard_error[ok] = np.sqrt(residual_variance[ok] * np.linalg.pinv(jtj[ok], hermitian=True)[:, 0, 0])
+    return log_ic50_interval(theta[:, 0], standard_error, dof, level)
+
+
+# Each curve draws from its own stream, so its interval does not depend on the chunk, block or worker it ran in
+def _row_rng(seed, key):
+    return np.random.default_rng([seed, zlib.crc32(str(key).encode('utf-8'))])
+
+
+# Residual bootstrap of a block of rows, all resamples refitted in one fit_hill_batch call
+def _bootstrap_block(block, n_samples, level, seed, max_iter):
+    concentrations, responses, params, keys = block
+    n_rows, n_points = responses.shape
+    log_conc = np.log(np.clip(concentrations, 1e-10, np.inf))
+    theta = params.copy()
+    theta[:, 0] = np.log(theta[:, 0])
+    fitted, _ = _hill_batch(log_conc, theta)
+    residuals = responses - fitted
+    # Centred residuals, rescaled so their variance accounts for the four fitted parameters
+    residuals = (residuals - residuals.mean(axis=1, keepdims=True)) * np.sqrt(n_points / max(n_points - params.shape[1], 1))
+
+    draws = np.stack([_row_rng(seed, key).integers(0, n_points, (n_samples, n_points)) for key in keys])
+    samples = fitted[:, None, :] + np.take_along_axis(np.broadcast_to(residuals[:, None, :], draws.shape), draws, axis=2)
+    # Every resample starts from the fit of the original data; resamples stopped early keep their IC50,
+    # so a curve whose IC50 drifts out of the tested range widens the interval instead of dropping out of it
+    ic50, _, _, _, _, _ = fit_hill_batch(np.repeat(concentrations, n_samples, axis=0), samples.reshape(-1, n_points),
+                                         np.repeat(params, n_samples, axis=0), max_iter=max_iter)
+    tail = 100 * (1 - level) / 2
+    with warnings.catch_warnings():
+        # All-NaN rows (no resample converged) give NaN bounds
+        warnings.simplefilter('ignore', RuntimeWarning)
+        low, high = np.nanpercentile(ic50.reshape(n_rows, n_samples), [tail, 100 - tail], axis=1)
+    return low, high
+
+
+# Percentile bootstrap IC50 interval of every row, refitting its fitted curve plus resampled residuals n_samples times
+# Blocks of about bootstrap_block_fits fits each run as one fit_hill_batch call, spread over n_workers processes
+# keys name the rows (e.g. drug and cell line) and seed their random streams together with seed; rows without a fit get NaN
+def bootstrap_ic50_interval(concentrations, responses, params, keys, n_samples=1000, level=0.95, seed=0, max_iter=2000, n_workers=1):
+    responses = np.asarray(responses, dtype=float)
+    concentrations = np.broadcast_to(np.asarray(concentrations, dtype=float), responses.shape)
+    params = np.asarray(params, dtype=float)
+    low = np.full(len(responses), np.nan)
+    high = np.full(len(responses), np.nan)
+    rows = np.flatnonzero(np.isfinite(params).all(axis=1) & (params[:, 0] > 0) & np.isfinite(responses).all(axis=1))
+    if rows.size == 0 or n_samples < 1:
+        return low, high
+
+    rows_per_block = max(1, bootstrap_block_fits // n_samples)
+    blocks = [(concentrations[block], responses[block], params[block], [keys[i] for i in block])
+              for block in np.array_split(rows, -(-rows.size // rows_per_block))]
+    run_block = partial(_bootstrap_block, n_samples=n_samples, level=level, seed=seed, max_iter=max_iter)
+    if n_workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            intervals = list(executor.map(run_block, blocks))
+    else:
+        intervals = list(map(run_block, blocks))
+    low[rows] = np.concatenate([interval[0] for interval in intervals])
+    high[rows] = np.concatenate([interval[1] for interval in intervals])
+    return low, high
@@ -1,189 +1,578 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.optimize import curve_fit
-from sklearn.metrics import auc
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
+from scipy.special import expit, hyp2f1
+import logging
 import os
-import win32com.client
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from data_partition import partition_frame
+from ic50_intervals import bootstrap_ic50_interval, log_ic50_interval
+from excel_cache import read_excel_cached
+from chunked_store import column_names, distinct_rows, iter_source_chunks, scan_path
+from curve_pipeline import output_paths, plots_rendered, run_curve_pipeline, render_stored_plots as render_stored_curve_plots
+from result_store import input_hash, load_result_store, cached_result, ResultStoreWriter
+from curve_renderer import shared_renderer, smooth_concentrations
+from run_report import RunReport, configure_logging, fit_quality
 
-# Load the data files
-file_24h = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Elin dose and time points\Elin_U2OS_PL\U2OS_finalPreparedDR_24h_50cutoff.xlsx'
-file_72h = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Elin dose and time points\Elin_U2OS_PL\U2OS_finalPreparedDR_72h_50cutoff.xlsx'
-file_ic50_initial = r"C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Elin dose and time points\Elin_U2OS_PL\U2OS_initial_guesses.xlsx"
+logger = logging.getLogger(__name__)
 
-data_24h = pd.read_excel(file_24h)
-data_72h = pd.read_excel(file_72h)
-ic50_initial = pd.read_excel(file_ic50_initial)
+# Default settings for main(); any of them can be overridden with main(config) or the run_pipeline.py CLI
+# The data files, one per time point (hours)
+time_point_files = {}
+# Alternatively one long-format table (.xlsx or .csv) with Batch_nr, Conc_nM, inhibition and the condition columns
+long_format_file = None
+# Initial IC50 and slope guesses per batch; None starts every fit from data-driven guesses
+file_ic50_initial = None
 
-# Add time point information
-data_24h['time'] = 24
-data_72h['time'] = 72
+# Columns that together identify a condition (time point, cell line, ...); every (batch, condition) pair is fitted
+# Time-point files get a 'time' column. Conditions are labelled '24h' for time and by value otherwise, joined with '_'
+condition_columns = ['time']
 
-# Standardize column names
-data_72h.columns = data_24h.columns
+# Time-shift metrics: None skips them, otherwise the condition column to compare along (e.g. 'time')
+# Each condition gets the IC50 fold change and AUC difference against the condition with the smallest value
+# in this column that agrees on all other condition columns
+time_shift_column = None
 
-# Combine data into a single DataFrame
-combined_data = pd.concat([data_24h, data_72h])
+# Output locations for the figures and the summary workbook
+# Without a figures_dir no plots are drawn; main() needs an excel_path
+output_dir = None
+figures_dir = None
+excel_path = None
 
-# Rename columns in ic50_initial to match the format we need
-ic50_initial = ic50_initial.rename(columns={
-    'IC50_24': 'IC50_24h', 
-    'Slope_24': 'Slope_24h',
-    'IC50_72': 'IC50_72h', 
-    'Slope_72': 'Slope_72h'
-})
+# Number of worker processes used to fit and plot the batches (1 runs everything in this process)
+n_workers = 1
 
-# Convert initial IC50 guesses from M to nM
-ic50_initial['IC50_24h'] *= 1e9
-ic50_initial['IC50_72h'] *= 1e9
+# Only refit and replot batches whose input rows or fit settings changed since the last run
+# Without a result_store_path nothing is stored; main() then keeps the store next to the summary workbook
+incremental = True
+result_store_path = None
 
-# Merge initial IC50 and slope guesses with combined data
-combined_data = combined_data.merge(ic50_initial, on='Batch_nr', how='left')
+# Write <summary workbook>_run_report.json and _run_report_fits.csv with stage timings and per-fit statistics
+run_report = True
+
+# Summary output, one of curve_pipeline.output_formats
+output_format = 'xlsx'
+
+# Memory budget (MB) for processing the batches in chunks; None processes all batches at once
+memory_budget_mb = None
+
+# Plot settings: render_plots = False skips the PNGs, they can be drawn later with render_stored_plots()
+# None draws them unless output_format is 'html', whose report draws the curves itself
+render_plots = None
+plot_dpi = 100  # Lower for thumbnails
+
+# AUC integration domain: 'linear' integrates over concentration, 'log10' over log10(concentration) as plotted
+auc_domain = 'linear'
+
+# Confidence level (e.g. 0.95) of the per-condition IC50 intervals from the curve_fit covariance; None leaves them out
+# With bootstrap_samples > 0 each fit also gets percentile bounds from that many refitted residual resamples
+confidence_level = None
+bootstrap_samples = 1000
+bootstrap_seed = 0
+
+# Everything that changes the fitted result; part of each batch's content hash
+fit_settings = {'model': 'logistic', 'space': 'log-concentration', 'maxfev': 2000}
+
+# Layout of the stored batch results; batches stored under another version are refitted
+result_version = 3
+
+def default_config():
+    return {
+        'time_point_files': dict(time_point_files),
+        'long_format_file': long_format_file,
+        'initial_guess_file': file_ic50_initial,
+        'condition_columns': list(condition_columns),
+        'time_shift_column': time_shift_column,
+        'output_dir': output_dir,
+        'figures_dir': figures_dir,
+        'excel_path': excel_path,
+        'n_workers': n_workers,
+        'incremental': incremental,
+        'result_store_path': result_store_path,
+        'render_plots': render_plots,
+        'plot_dpi': plot_dpi,
+        'auc_domain': auc_domain,
+        'run_report': run_report,
+        'output_format': output_format,
+        'memory_budget_mb': memory_budget_mb,
+        'confidence_level': confidence_level,
+        'bootstrap_samples': bootstrap_samples,
+        'bootstrap_seed': bootstrap_seed
+    }
+
+def logistic_model(x, A, B, C, D):
+    return A + (B - A) / (1.0 + (C / x)**D)
+
+# The same model fitted in log-concentration space: u = ln(x), log_ic50 = ln(C)
+def log_logistic_model(u, A, B, log_ic50, D):
+    return A + (B - A) * expit(D * (u - log_ic50))
+
+# Closed-form Jacobian of log_logistic_model, one column per parameter
+def log_logistic_jacobian(u, A, B, log_ic50, D):
+    s = expit(D * (u - log_ic50))
+    ds = (B - A) * s * (1 - s)
+    return np.column_stack([1 - s, s, -D * ds, (u - log_ic50) * ds])
+
+# ln(conc) for the log-space fit; zero (vehicle) concentrations have no logarithm and are placed 6 decades below the
+# lowest tested concentration, where the curve sits on its plateau just as logistic_model does at x = 0
+def log_concentrations(conc):
+    conc = np.asarray(conc, dtype=float)
+    positive = conc[conc > 0]
+    if positive.size == 0:
+        raise ValueError("No positive concentrations to fit")
+    return np.log(np.maximum(conc, np.min(positive) * 1e-6))
+
+# Data-driven starting point: plateaus at the extreme responses, IC50 at the tested (non-zero)
+# concentration closest to the midpoint, slope sign from the direction of the response
+def logistic_initial_guesses(conc, inhib):
+    order = np.argsort(conc)
+    rising = inhib[order[-1]] >= inhib[order[0]]
+    midpoint = (np.min(inhib) + np.max(inhib)) / 2
+    distance = np.where(conc > 0, np.abs(inhib - midpoint), np.inf)
+    ic50 = conc[np.argmin(distance)] if np.any(conc > 0) else np.nan
+    return [np.min(inhib), np.max(inhib), np.log(ic50), 1.0 if rising else -1.0]
+
+# Closed-form area under logistic_model between x_low and x_high, vectorized over all arguments
+def logistic_auc(A, B, C, D, x_low, x_high, domain='linear'):
+    A, B, C, D, x_low, x_high = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (A, B, C, D, x_low, x_high)))
+    if domain == 'linear':
+        # With E = |D|, the integral of 1 / (1 + (x/C)^E) from 0 to x is x * 2F1(1, 1/E; 1 + 1/E; -(x/C)^E);
+        # logistic_model rises by (B - A) times that complement for D > 0 and falls with it for D < 0
+        E = np.where(D != 0, np.abs(D), 1.0)
+        def primitive(x):
+            with np.errstate(over='ignore'):
+                falling = x * hyp2f1(1.0, 1.0 / E, 1.0 + 1.0 / E, -(x / C) ** E)
+            return np.where(D > 0, x - falling, np.where(D < 0, falling, x / 2))
+        return A * (x_high - x_low) + (B - A) * (primitive(x_high) - primitive(x_low))
+    if domain == 'log10':
+        # In log space the logistic integrates to a softplus: ln(1 + exp(D * (ln x - ln C))) / D
+        safe_D = np.where(D != 0, D, 1.0)
+        def primitive(x):
+            return np.where(D != 0, np.logaddexp(0, safe_D * (np.log(x) - np.log(C))) / safe_D, np.log(x) / 2) / np.log(10)
+        return A * (np.log10(x_high) - np.log10(x_low)) + (B - A) * (primitive(x_high) - primitive(x_low))
+    raise ValueError(f"Unknown AUC domain: {domain}")
 
 # Function to fit dose-response curve and calculate IC50 and AUC
-def dose_response_curve(conc, inhib, time, batch, initial_ic50, initial_slope):
+# Also returns the standard error of ln(IC50) from the covariance curve_fit reports (NaN without a fit)
+def dose_response_curve(conc, inhib, condition, batch, initial_ic50, initial_slope, maxfev=fit_settings['maxfev'], auc_domain=auc_domain):
+    conc = np.asarray(conc, dtype=float)
+    inhib = np.asarray(inhib, dtype=float)
     if len(conc) < 4:
-        print(f"Not enough data points for batch {batch} at {time}h.")
-        return np.nan, np.nan
+        logger.warning("Not enough data points for batch %s at %s.", batch, condition)
+        return np.nan, np.nan, [np.nan] * 4, 0, np.nan
     
-    def logistic_model(x, A, B, C, D):
-        return A + (B - A) / (1.0 + (C / x)**D)
+    # Early exit: a flat response has no IC50 to find
+    if np.ptp(inhib) <= 1e-9 * max(np.max(np.abs(inhib)), 1):
+        logger.warning("Flat response for batch %s at %s.", batch, condition)
+        return np.nan, np.nan, [np.nan] * 4, 0, np.nan
     
-    # Use the initial IC50 and slope values as the starting points for curve fitting
-    initial_guesses = [np.min(inhib), np.max(inhib), initial_ic50, initial_slope]
+    # Use the initial IC50 and slope values as the starting points for curve fitting,
+    # falling back to a data-driven guess when they are missing, invalid or do not converge
+    starts = []
+    if np.isfinite(initial_ic50) and initial_ic50 > 0 and np.isfinite(initial_slope):
+        starts.append([np.min(inhib), np.max(inhib), np.log(initial_ic50), initial_slope])
+    starts.append(logistic_initial_guesses(conc, inhib))
     
+    # Number of model evaluations spent on this fit
+    evaluations = 0
     try:
-        popt, _ = curve_fit(logistic_model, conc, inhib, p0=initial_guesses, maxfev=100000)
-        A, B, C, D = popt
-        ic50 = C
-        # Generate 500 evenly spaced values between min and max concentration for a smooth curve
-        x_vals = np.linspace(min(conc), max(conc), 500)
-        y_vals = logistic_model(x_vals, *popt)
-        area = auc(x_vals, y_vals)
-        
-        # Plot the smooth curve
-        plt.plot(x_vals, y_vals, label=f'{time}h (IC50={ic50:.2f}, AUC={area:.2f})')
-        
-        # Plot the data points
-        plt.scatter(conc, inhib, color=plt.gca().lines[-1].get_color(), s=50, zorder=5)  # Same color as the curve, size 50
+        for attempt, initial_guesses in enumerate(starts):
+            try:
+                popt, pcov, infodict, _, _ = curve_fit(log_logistic_model, log_concentrations(conc), inhib, p0=initial_guesses, jac=log_logistic_jacobian, full_output=True, maxfev=maxfev)
+                evaluations += infodict['nfev']
+                break
+            except RuntimeError:
+                evaluations += maxfev
+                if attempt == len(starts) - 1:
+                    raise
+        A, B, log_ic50, D = popt
+        popt = np.array([A, B, np.exp(log_ic50), D])
+        ic50 = popt[2]
+        # curve_fit gives an infinite covariance when the data cannot determine the parameters
+        log_ic50_se = np.sqrt(pcov[2, 2]) if np.isfinite(pcov[2, 2]) and pcov[2, 2] >= 0 else np.nan
+        # AUC over the tested concentration range, integrated analytically; on a log axis it starts at the lowest
+        # non-zero concentration
+        x_low = np.min(conc) if auc_domain == 'linear' else np.min(conc[conc > 0])
+        area = float(logistic_auc(*popt, x_low, np.max(conc), domain=auc_domain))
         
-        return ic50, area
-    except RuntimeError:
-        print(f"Optimal parameters not found for batch {batch} at {time}h.")
-        return np.nan, np.nan
-
-# Create a new Excel workbook
-wb = Workbook()
-ws = wb.active
-ws.title = "combined_time_points"
-
-# Write the header row
-header = [
-    'Batch_nr', 'IC50_24h', 'IC50_72h', 'AUC_24h', 'AUC_72h', 'GRAPH'
-]
-ws.append(header)
-
-# Adjust column width for the 'GRAPH' column
-graph_col_letter = get_column_letter(len(header))
-ws.column_dimensions[graph_col_letter].width = 40  # Adjust as needed
-
-# Save the initial workbook
-output_dir = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Elin dose and time points\Elin_U2OS_PL'
-figures_dir = os.path.join(output_dir, 'figures')
-os.makedirs(figures_dir, exist_ok=True)
-excel_path = os.path.join(output_dir, 'U2OS_combined_time_points_with_plots_50cutoff.xlsx')
-wb.save(excel_path)
-
-# Plotting function
-def plot_ic50_curve(batch_data, batch, ws, row_idx):
-    plt.figure(figsize=(6, 4))  # Adjust the figure size as needed
+        return ic50, area, popt.tolist(), evaluations, log_ic50_se
+    except (RuntimeError, ValueError):
+        logger.warning("Optimal parameters not found for batch %s at %s.", batch, condition)
+        return np.nan, np.nan, [np.nan] * 4, evaluations, np.nan
+
+# Percentile bootstrap IC50 interval of one logistic fit, by refitting residual resamples with the batched Hill fit
+# logistic_model is the Hill equation with plateaus B and A (or A and B for a negative slope) and slope |D|;
+# the responses are shifted up so both plateaus stay within fit_hill_batch's non-negative bounds
+def logistic_bootstrap_interval(conc, inhib, popt, key, n_samples, level=0.95, seed=0):
+    A, B, C, D = popt
+    min_resp, max_resp = (B, A) if D > 0 else (A, B)
+    offset = 2 * max(np.max(np.abs(inhib)), abs(A), abs(B))
+    params = np.array([[C, abs(D), min_resp + offset, max_resp + offset]])
+    low, high = bootstrap_ic50_interval(np.asarray(conc, dtype=float)[None], np.asarray(inhib, dtype=float)[None] + offset, params, [key],
+                                        n_samples=n_samples, level=level, seed=seed, max_iter=fit_settings['maxfev'])
+    return low[0], high[0]
+
+# Status, R² and RMSE of one dose_response_curve fit, for the run report
+def logistic_fit_stats(conc, inhib, popt, evaluations, seconds, label):
+    conc = np.asarray(conc, dtype=float)
+    inhib = np.asarray(inhib, dtype=float)
+    if np.isfinite(popt[2]):
+        status = 'converged'
+    elif len(conc) < 4:
+        status = 'too few points'
+    elif evaluations == 0:
+        status = 'flat'
+    else:
+        status = 'failed'
+    with np.errstate(all='ignore'):
+        r_squared, rmse = fit_quality(inhib, logistic_model(conc, *popt)) if len(conc) else ([np.nan], [np.nan])
+    return {'label': label, 'status': status, 'evaluations': int(evaluations), 'seconds': seconds,
+            'r_squared': float(r_squared[0]), 'rmse': float(rmse[0])}
+
+# Draw the fitted curves and data points of one batch with the shared Agg renderer
+def draw_curves(curves, batch, plot_filename, dpi=plot_dpi):
+    series = []
+    for curve in curves:
+        x_vals = smooth_concentrations(curve['concentrations'])
+        y_vals = logistic_model(x_vals, *curve['params'])
+        series.append((curve['label'], x_vals, y_vals, curve['concentrations'], curve['responses']))
+    renderer = shared_renderer(dpi=dpi, markersize=np.sqrt(50))  # Same marker size as scatter(s=50)
+    renderer.render(plot_filename, f'Dose-Response Curves for Batch {batch}', series)
+
+# Fit each condition of one batch (rows labelled by a 'condition' column, see condition_labels) and plot the curves together
+# conditions defaults to those of batch_data in order of appearance; plot_dir=None skips drawing the PNG
+# With a confidence_level each IC50 also gets covariance and (if bootstrap_samples > 0) bootstrap interval bounds
+# The result records the seconds spent on the whole batch and on drawing its PNG, for the run report
+def plot_ic50_curve(batch_data, batch, conditions=None, plot_dir=None, dpi=plot_dpi, auc_domain=auc_domain,
+                    confidence_level=None, bootstrap_samples=0, bootstrap_seed=0):
+    batch_start = perf_counter()
     ic50_values = []
     auc_values = []
+    fit_params = []
+    fit_evaluations = []
+    fit_stats = []
+    ic50_intervals = []
+    curves = []
     
-    for time in [24, 72]:
-        data_subset = batch_data[batch_data['time'] == time]
-        initial_ic50 = data_subset[f'IC50_{time}h'].iloc[0]
-        initial_slope = data_subset[f'Slope_{time}h'].iloc[0]
-        ic50, area = dose_response_curve(data_subset['Conc_nM'], data_subset['inhibition'], time, batch, initial_ic50, initial_slope)
+    condition_partitions = dict(partition_frame(batch_data, 'condition'))
+    if conditions is None:
+        conditions = list(condition_partitions)
+    for condition in conditions:
+        # A batch without rows for this condition gets NaN results
+        data_subset = condition_partitions.get(condition, batch_data.iloc[:0])
+        initial_ic50 = data_subset[f'IC50_{condition}'].iloc[0] if len(data_subset) and f'IC50_{condition}' in data_subset else np.nan
+        initial_slope = data_subset[f'Slope_{condition}'].iloc[0] if len(data_subset) and f'Slope_{condition}' in data_subset else np.nan
+        start = perf_counter()
+        ic50, area, popt, evaluations, log_ic50_se = dose_response_curve(data_subset['Conc_nM'], data_subset['inhibition'], condition, batch, initial_ic50, initial_slope,
+                                                                         maxfev=fit_settings['maxfev'], auc_domain=auc_domain)
+        seconds = perf_counter() - start
         ic50_values.append(ic50)
         auc_values.append(area)
-    
-    plt.xscale('log')
-    plt.xlabel('Concentration')
-    plt.ylabel('Response')
-    plt.title(f'Dose-Response Curves for Batch {batch}')
-    plt.legend()
-    plt.grid(True)
+        fit_params.append(popt)
+        fit_evaluations.append(evaluations)
+        fit_stats.append(logistic_fit_stats(data_subset['Conc_nM'], data_subset['inhibition'], popt, evaluations, seconds, condition))
+        interval = [np.nan] * 4
+        if confidence_level is not None and not np.isnan(ic50):
+            interval[:2] = log_ic50_interval(np.log(ic50), log_ic50_se, len(data_subset) - 4, confidence_level)
+            if bootstrap_samples > 0:
+                interval[2:] = logistic_bootstrap_interval(data_subset['Conc_nM'], data_subset['inhibition'], popt, f'{batch}|{condition}',
+                                                           bootstrap_samples, level=confidence_level, seed=bootstrap_seed)
+        ic50_intervals.append([float(value) for value in interval])
+        if not np.isnan(ic50):
+            curves.append({
+                'label': f'{condition} (IC50={ic50:.2f}, AUC={area:.2f})',
+                'params': popt,
+                'concentrations': data_subset['Conc_nM'].tolist(),
+                'responses': data_subset['inhibition'].tolist()
+            })
     
     # Save the plot to a file in the figures folder
-    plot_filename = os.path.join(figures_dir, f'{batch}_ic50_curve.png')
-    plt.savefig(plot_filename, bbox_inches='tight')
-    plt.close()
-    
-    # Append IC50 and AUC values to the worksheet
-    ws.append([batch] + ic50_values + auc_values + [''])
+    plot_filename = None
+    render_seconds = 0.0
+    if plot_dir is not None:
+        plot_filename = os.path.join(plot_dir, f'{batch}_ic50_curve.png')
+        start = perf_counter()
+        draw_curves(curves, batch, plot_filename, dpi=dpi)
+        render_seconds = perf_counter() - start
     
-    return plot_filename, row_idx
-
-# Generate plots for each batch
-plot_filenames = []
-batches = combined_data['Batch_nr'].unique()
-for batch in batches:
-    batch_data = combined_data[combined_data['Batch_nr'] == batch]
-    row_idx = ws.max_row + 1
-    plot_filename, row_idx = plot_ic50_curve(batch_data, batch, ws, row_idx)
-    plot_filenames.append((plot_filename, row_idx))
-
-# Save the workbook
-wb.save(excel_path)
-
-# Insert images into the Excel workbook using win32com.client
-Excel = win32com.client.Dispatch("Excel.Application")
-Excel.Visible = False
-wb_win32 = Excel.Workbooks.Open(excel_path)
-ws_win32 = wb_win32.Worksheets("combined_time_points")
-
-# Find the column named "GRAPH"
-graph_col = None
-for col in range(1, ws_win32.UsedRange.Columns.Count + 1):
-    if ws_win32.Cells(1, col).Value == 'GRAPH':
-        graph_col = col
-        break
-
-if graph_col is None:
-    raise ValueError("The column 'GRAPH' was not found in the Excel sheet.")
-
-for pic_path, row_idx in plot_filenames:
-    # Verify that the image file exists
-    if not os.path.exists(pic_path):
-        print(f"File not found: {pic_path}")
-        continue
-    
-    # Debug statements
-    print(f"Inserting image: {pic_path}")
-    print(f"Row index: {row_idx}")
+    return {
+        'plot_filename': plot_filename,
+        'seconds': perf_counter() - batch_start,
+        'render_seconds': render_seconds,
+        'ic50_values': ic50_values,
+        'auc_values': auc_values,
+        'fit_params': fit_params,
+        'fit_evaluations': fit_evaluations,
+        'fit_stats': fit_stats,
+        'ic50_intervals': ic50_intervals,
+        'curves': curves
+    }
 
-    # Set row height
-    ws_win32.Rows(row_idx).RowHeight = 120  # Adjust as needed
-    
-    left = ws_win32.Cells(row_idx, graph_col).Left
-    top = ws_win32.Cells(row_idx, graph_col).Top
-    col_width = ws_win32.Columns(graph_col).ColumnWidth * 7.5  # Approximate width in points
-    img_width, img_height = plt.imread(pic_path).shape[1], plt.imread(pic_path).shape[0]
-    aspect_ratio = img_width / img_height
-    width = col_width
-    height = width / aspect_ratio
-
-    if height > ws_win32.Rows(row_idx).RowHeight:
-        height = ws_win32.Rows(row_idx).RowHeight
-        width = height * aspect_ratio
-    
-    print(f"Position: left={left}, top={top}, width={width}, height={height}")
-    
-    ws_win32.Shapes.AddPicture(pic_path, LinkToFile=False, SaveWithDocument=True, Left=left, Top=top, Width=width, Height=height)
+# Draw PNGs on demand from the fit parameters and data points kept in the result store
+def render_stored_plots(batches=None, config=None):
+    config = dict(default_config(), **(config or {}))
+    render_stored_curve_plots(draw_curves, config['result_store_path'], config['figures_dir'], config['plot_dpi'], keys=batches)
+
+# Read the dose-response table of each time point and the initial guesses into one DataFrame with a 'time' column
+def load_time_points(time_point_files, initial_guess_file=None):
+    # Combine data into a single DataFrame
+    combined_data = pd.concat(read_time_point_tables(time_point_files))
+    if initial_guess_file is None:
+        return combined_data
+    return combined_data.merge(prepare_initial_guesses(read_excel_cached(initial_guess_file), [f'{time}h' for time in time_point_files]),
+                               on='Batch_nr', how='left')
+
+# The table of each time point, with the column names of the first one and a 'time' column
+def read_time_point_tables(time_point_files):
+    data_frames = []
+    columns = None
+    for time, path in time_point_files.items():
+        df = read_excel_cached(path)
+        # Standardize column names on those of the first time point
+        if columns is None:
+            columns = df.columns
+        df.columns = columns
+        # Add time point information
+        df['time'] = time
+        data_frames.append(df)
+    return data_frames
+
+# Label of each row's condition: 'time' values as hours ('24h'), other condition columns by value, joined with '_'
+def condition_labels(data, condition_columns):
+    parts = [data[column].astype(str) + 'h' if column == 'time' else data[column].astype(str) for column in condition_columns]
+    labels = parts[0]
+    for part in parts[1:]:
+        labels = labels + '_' + part
+    return labels
+
+# The distinct conditions of the tables, sorted by the condition columns: the condition columns and their 'condition' label
+def condition_table(tables, condition_columns):
+    conditions = pd.concat([table[condition_columns].drop_duplicates() for table in tables]).drop_duplicates()
+    conditions = conditions.sort_values(condition_columns, kind='stable')
+    return conditions.assign(condition=condition_labels(conditions, condition_columns)).reset_index(drop=True)
+
+# (condition, reference) label pairs for the time-shift metrics: each condition against the one with the smallest
+# shift_column value among the conditions that agree on all other condition columns
+def time_shift_pairs(conditions, condition_columns, shift_column):
+    if shift_column not in condition_columns:
+        raise ValueError(f"Time-shift column {shift_column!r} is not one of the condition columns {condition_columns}")
+    other_columns = [column for column in condition_columns if column != shift_column]
+    groups = conditions.groupby(other_columns, sort=False) if other_columns else [(None, conditions)]
+    pairs = []
+    for _, group in groups:
+        reference = group.loc[group[shift_column].idxmin(), 'condition']
+        pairs += [(condition, reference) for condition in group['condition'] if condition != reference]
+    return pairs
+
+# The long-format input tables of a screen, its condition table and its initial guesses (None without a guess file)
+# A long_format_file is used as it is; otherwise each time-point file becomes one table with a 'time' column
+def read_screen(config):
+    if config['long_format_file'] is None:
+        tables = read_time_point_tables(config['time_point_files'])
+    elif config['long_format_file'].endswith('.csv'):
+        # Parsed exactly, as chunked runs read it through pyarrow, so both give the same values and content hashes
+        tables = [pd.read_csv(config['long_format_file'], float_precision='round_trip')]
+    else:
+        tables = [read_excel_cached(config['long_format_file'])]
+    conditions = condition_table(tables, config['condition_columns'])
+    return tables, conditions, read_initial_guesses(config, conditions)
+
+# The initial guesses of a screen for its condition table, None without a guess file
+def read_initial_guesses(config, conditions):
+    if config['initial_guess_file'] is None:
+        return None
+    return prepare_initial_guesses(read_excel_cached(config['initial_guess_file']), conditions['condition'])
+
+# The input files of a screen for a chunked run: (scanned path, column renames, time) for each time-point file,
+# the renames giving it the column names of the first one as in read_time_point_tables, or the long_format_file as it is
+def screen_files(config):
+    if config['long_format_file'] is not None:
+        return [(scan_path(config['long_format_file']), {}, None)]
+    files = []
+    columns = None
+    for time, path in config['time_point_files'].items():
+        path = scan_path(path)
+        if columns is None:
+            columns = column_names(path)
+        files.append((path, dict(zip(column_names(path), columns)), time))
+    return files
+
+# Rows read from one screen file, with the renamed columns and the 'time' column of a time-point file
+def screen_file_rows(rows, renames, time):
+    rows = rows.rename(columns=renames)
+    return rows if time is None else rows.assign(time=time)
+
+# What read_screen returns for a chunked run, without reading the screen into memory: chunk sources for
+# iter_source_chunks reading each file's rows by Batch_nr, and the condition table from each file's distinct conditions
+def scan_screen(config):
+    sources = []
+    tables = []
+    for path, renames, time in screen_files(config):
+        file_columns = {column: file_column for file_column, column in renames.items()}
+        prepare = partial(screen_file_rows, renames=renames, time=time)
+        sources.append((path, file_columns.get('Batch_nr', 'Batch_nr'), prepare))
+        columns = [file_columns.get(column, column) for column in config['condition_columns'] if column != 'time' or time is None]
+        tables.append(prepare(distinct_rows(path, columns) if columns else pd.DataFrame(index=[0])))
+    conditions = condition_table(tables, config['condition_columns'])
+    return sources, conditions, read_initial_guesses(config, conditions)
+
+# Yield the rows of the screen's files, merged with the initial guesses, in chunks of whole batches sized to the memory budget
+# Each chunk is merged with the initial guesses on its own
+def iter_time_point_chunks(sources, initial_guesses, memory_budget_mb):
+    for chunk_data in iter_source_chunks(sources, memory_budget_mb):
+        yield chunk_data if initial_guesses is None else chunk_data.merge(initial_guesses, on='Batch_nr', how='left')
+
+# Initial IC50 (M) and slope guesses per batch, as IC50_<condition> (nM) and Slope_<condition> for each condition label
+# Columns named without the 'h' of a time label (IC50_24 for '24h') are renamed
+def prepare_initial_guesses(ic50_initial, conditions):
+    # Rename columns in ic50_initial to match the format we need
+    renames = {}
+    for condition in conditions:
+        if condition.endswith('h'):
+            renames[f'IC50_{condition[:-1]}'] = f'IC50_{condition}'
+            renames[f'Slope_{condition[:-1]}'] = f'Slope_{condition}'
+    ic50_initial = ic50_initial.rename(columns=renames)
+
+    # Convert initial IC50 guesses from M to nM
+    for condition in conditions:
+        if f'IC50_{condition}' in ic50_initial:
+            ic50_initial[f'IC50_{condition}'] *= 1e9
+    return ic50_initial
+
+# One summary row per batch: IC50 and AUC for each condition, and the plot path
+# confidence_intervals=True adds the covariance and bootstrap interval bounds of each IC50 after the AUCs,
+# shift_pairs (see time_shift_pairs) the IC50 fold change and AUC difference of each condition against its reference
+def summary_table(results, conditions, confidence_intervals=False, shift_pairs=()):
+    columns = ['Batch_nr'] + [f'IC50_{condition}' for condition in conditions] + [f'AUC_{condition}' for condition in conditions]
+    if confidence_intervals:
+        columns += [f'IC50_{condition} {bound}' for condition in conditions for bound in ['CI low', 'CI high', 'bootstrap low', 'bootstrap high']]
+    rows = []
+    for batch, result in results.items():
+        row = [batch] + result['ic50_values'] + result['auc_values']
+        if confidence_intervals:
+            row += [value for interval in result['ic50_intervals'] for value in interval]
+        rows.append(row)
+    summary = pd.DataFrame(rows, columns=columns)
+    for condition, reference in shift_pairs:
+        summary[f'IC50_fold_{condition}_vs_{reference}'] = summary[f'IC50_{condition}'] / summary[f'IC50_{reference}']
+        summary[f'AUC_delta_{condition}_vs_{reference}'] = summary[f'AUC_{condition}'] - summary[f'AUC_{reference}']
+    summary['GRAPH'] = [result['plot_filename'] for result in results.values()]
+    return summary
+
+# Fit, plot and summarize every (batch, condition) pair in combined_data (long format, as returned by load_time_points)
+# conditions is a condition_table; by default the one of combined_data
+# Stage timings and per-fit statistics are added to report when one is given
+# A caller that summarizes in chunks passes the ResultStoreWriter that collects the results of every chunk
+# PNGs are only drawn into a figures_dir and results only stored in a result_store_path given in config
+def summarize_time_points(combined_data, conditions=None, config=None, report=None, store_writer=None):
+    config = dict(default_config(), **(config or {}))
+    report = report or RunReport('time points')
+    if conditions is None:
+        conditions = condition_table([combined_data], config['condition_columns'])
+    condition_names = list(conditions['condition'])
+    shift_pairs = []
+    if config['time_shift_column'] is not None:
+        shift_pairs = time_shift_pairs(conditions, config['condition_columns'], config['time_shift_column'])
+    combined_data = combined_data.assign(condition=condition_labels(combined_data, config['condition_columns']))
+    plot_dir = config['figures_dir'] if plots_rendered(config) else None
+
+    # Create output directory for plots
+    if plot_dir is not None:
+        os.makedirs(plot_dir, exist_ok=True)
+
+    # The data is partitioned by batch once instead of masking the full table per batch
+    batch_partitions = partition_frame(combined_data, 'Batch_nr')
+    batches = [batch for batch, _ in batch_partitions]
+
+    # Reuse stored results for batches whose input rows are unchanged since the last run
+    with report.stage('lookup', len(batches)):
+        incremental = config['incremental'] and config['result_store_path'] is not None
+        store = load_result_store(config['result_store_path'], keys=batches) if incremental else {}
+        hash_settings = dict(fit_settings, conditions=condition_names, auc_domain=config['auc_domain'],
+                             render_plots=plot_dir is not None, plot_dpi=config['plot_dpi'], plot_dir=plot_dir,
+                             result_version=result_version, confidence_level=config['confidence_level'],
+                             bootstrap_samples=config['bootstrap_samples'], bootstrap_seed=config['bootstrap_seed'])
+        input_hashes = {batch: input_hash(batch_data, hash_settings) for batch, batch_data in batch_partitions}
+        results = {batch: cached_result(store, batch, input_hashes[batch]) for batch in batches}
+        changed_partitions = [(batch, batch_data) for batch, batch_data in batch_partitions if results[batch] is None]
+    logger.info("Fitting %d of %d batches, reusing stored results for the rest", len(changed_partitions), len(batches))
+
+    # Generate plots for each changed batch
+    # Each batch is fitted and plotted independently; map() hands the results back in the original batch order
+    changed_batches = [batch for batch, _ in changed_partitions]
+    batch_data_list = [batch_data for _, batch_data in changed_partitions]
+    plot_batch = partial(plot_ic50_curve, conditions=tuple(condition_names), plot_dir=plot_dir, dpi=config['plot_dpi'], auc_domain=config['auc_domain'],
+                         confidence_level=config['confidence_level'], bootstrap_samples=config['bootstrap_samples'], bootstrap_seed=config['bootstrap_seed'])
+    start = perf_counter()
+    if config['n_workers'] > 1 and len(changed_batches) > 1:
+        with ProcessPoolExecutor(max_workers=config['n_workers']) as executor:
+            chunksize = max(1, len(changed_batches) // (config['n_workers'] * 4))
+            rendered = list(executor.map(plot_batch, batch_data_list, changed_batches, chunksize=chunksize))
+    else:
+        rendered = list(map(plot_batch, batch_data_list, changed_batches))
+    seconds = perf_counter() - start
+    # Each batch is fitted and plotted in one call, so the wall time is split into the fit and plot
+    # stages by the share of the batches' own time spent in draw_curves
+    worker_seconds = sum(result['seconds'] for result in rendered)
+    plot_share = sum(result['render_seconds'] for result in rendered) / worker_seconds if worker_seconds > 0 else 0.0
+    report.add_stage('fit', seconds * (1 - plot_share), len(changed_batches) * len(condition_names))
+    report.add_stage('plot', seconds * plot_share, len(changed_batches))
+    results.update(zip(changed_batches, rendered))
+    if rendered:
+        fit_evaluations = [n for result in rendered for n in result['fit_evaluations']]
+        logger.info("Model evaluations per fit: median %.0f, max %d", np.median(fit_evaluations), np.max(fit_evaluations))
+
+    # Per-fit statistics of every batch in this run; reused batches report the statistics of the run that fitted them
+    fitted_now = set(changed_batches)
+    report.add_fits(dict(stats, key=batch, cached=batch not in fitted_now) for batch in batches for stats in results[batch]['fit_stats'])
+
+    # Keep exactly the batches of this run in the store, if there is one
+    if store_writer is not None or config['result_store_path'] is not None:
+        with report.stage('store', len(batches)):
+            writer = store_writer or ResultStoreWriter(config['result_store_path'])
+            for batch in batches:
+                writer.add(batch, input_hashes[batch], results[batch])
+            if store_writer is None:
+                writer.close()
+
+    return summary_table(results, condition_names, confidence_intervals=config['confidence_level'] is not None, shift_pairs=shift_pairs)
+
+# The whole screen in long format, merged with the initial guesses
+def combine_tables(tables, initial_guesses):
+    combined_data = pd.concat(tables)
+    return combined_data if initial_guesses is None else combined_data.merge(initial_guesses, on='Batch_nr', how='left')
+
+# Run the whole pipeline for one screen; config overrides the defaults at the top of this file
+def main(config=None):
+    config = output_paths(dict(default_config(), **(config or {})))
+    report = RunReport('time points')
+    # A chunked run only scans the screen here; its chunks are read as they are summarized
+    with report.stage('load'):
+        if config['memory_budget_mb'] is None:
+            tables, conditions, initial_guesses = read_screen(config)
+            load_data, iter_data_chunks = partial(combine_tables, tables, initial_guesses), None
+        else:
+            sources, conditions, initial_guesses = scan_screen(config)
+            load_data, iter_data_chunks = None, partial(iter_time_point_chunks, sources, initial_guesses, config['memory_budget_mb'])
+    return run_curve_pipeline(config, report, load_data=load_data, iter_data_chunks=iter_data_chunks,
+                              summarize=partial(summarize_time_points, conditions=conditions, config=config, report=report),
+                              sheet_title="combined_time_points", model='logistic')
 
-wb_win32.Save()
-wb_win32.Close()
-Excel.Quit()
+if __name__ == '__main__':
+    # Load the data files, one per time point (hours)
+    output_dir = r'C:\Users\kun.qian\Desktop\Projects\U2OS phospholipidoses assay\Elin dose and time points\Elin_U2OS_PL'
+    configure_logging()
+    main({
+        'time_point_files': {
+            24: os.path.join(output_dir, 'U2OS_finalPreparedDR_24h_50cutoff.xlsx'),
+            72: os.path.join(output_dir, 'U2OS_finalPreparedDR_72h_50cutoff.xlsx')
+        },
+        'initial_guess_file': os.path.join(output_dir, 'U2OS_initial_guesses.xlsx'),
+        'output_dir': output_dir,
+        'figures_dir': os.path.join(output_dir, 'figures'),
+        'excel_path': os.path.join(output_dir, 'U2OS_combined_time_points_with_plots_50cutoff.xlsx'),
+        'n_workers': os.cpu_count(),
+        'result_store_path': os.path.join(output_dir, 'U2OS_time_point_fit_store.tsv')
+    })
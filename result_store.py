@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# Content hash of one drug's (or batch's) input rows together with the fit settings
+def input_hash(frame, settings):
+    row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    digest = hashlib.sha1(row_hashes.tobytes())
+    digest.update(repr(list(frame.columns)).encode('utf-8'))
+    digest.update(repr(sorted(settings.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# The store file (.tsv) holds one line per drug (or batch): its JSON-encoded key, a tab and the JSON {'hash': ..., 'result': ...}
+# so runs can look up just the entries they need and write the new store entry by entry
+
+# Yield (str(drug), entry) pairs, all or those of keys; stores written as one JSON object by older versions are read whole
+def iter_result_store(path, keys=None):
+    wanted = None if keys is None else {str(key) for key in keys}
+    with open(path, 'r') as store_file:
+        legacy = store_file.read(1) == '{'
+        store_file.seek(0)
+        if legacy:
+            for key, entry in json.load(store_file).items():
+                if wanted is None or key in wanted:
+                    yield key, entry
+            return
+        for line in store_file:
+            key, entry = line.split('\t', 1)
+            key = json.loads(key)
+            if wanted is None or key in wanted:
+                yield key, json.loads(entry)
+
+
+# The store maps str(drug) -> {'hash': ..., 'result': ...}, all entries or those of keys
+# A missing or unreadable file starts empty
+def load_result_store(path, keys=None):
+    if not os.path.exists(path):
+        return {}
+    try:
+        return dict(iter_result_store(path, keys))
+    except (OSError, ValueError):
+        return {}
+
+
+# Writes a store entry by entry to a temporary file, which close() moves into place
+# so an interrupted run never leaves a truncated store
+class ResultStoreWriter:
+    def __init__(self, path):
+        self.path = path
+        self.store_file = open(path + '.tmp', 'w')
+
+    def add(self, key, content_hash, result):
+        entry = json.dumps({'hash': content_hash, 'result': result}, default=_to_builtin)
+        self.store_file.write(json.dumps(str(key)) + '\t' + entry + '\n')
+
+    def close(self):
+        self.store_file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.store_file.close()
+            os.remove(self.path + '.tmp')
+
+
+# A stored result is reused only if the inputs are unchanged and its plot still exists
+def cached_result(store, key, content_hash):
+    entry = store.get(str(key))
+    if entry is None or entry['hash'] != content_hash:
+        return None
+    plot_filename = entry['result'].get('plot_filename')
+    if plot_filename and not os.path.exists(plot_filename):
+        return None
+    return entry['result']
+
+
+# json cannot serialize NumPy scalars and arrays directly
+def _to_builtin(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,145 @@
+import argparse
+import json
+import logging
+import os
+import combine_IC50curves_by_cell_line
+import merge_IC50curves_by_timepoints
+import Harmony_output_reformat_for_BREEZE
+from run_report import configure_logging
+
+# Pipelines that can be run from the command line, by subcommand name
+pipelines = {
+    'cell-lines': combine_IC50curves_by_cell_line,
+    'time-points': merge_IC50curves_by_timepoints,
+    'breeze': Harmony_output_reformat_for_BREEZE
+}
+
+# Settings the command line uses unless a config file or argument sets them; the library defaults run in one process
+cli_defaults = {
+    'cell-lines': {'n_workers': os.cpu_count()},
+    'time-points': {'n_workers': os.cpu_count()}
+}
+
+
+# NAME=PATH arguments -> {NAME: PATH}, e.g. --cell-line HL60=HL60.xlsx or --time-point 24=24h.xlsx
+def parse_mapping(items, key_type=str):
+    mapping = {}
+    for item in items:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected NAME=PATH, got {item!r}")
+        mapping[key_type(key)] = value
+    return mapping
+
+
+# Each config file holds one screen (a JSON object) or several (a JSON list of objects)
+def load_screens(config_paths):
+    screens = []
+    for path in config_paths:
+        with open(path, 'r') as config_file:
+            loaded = json.load(config_file)
+        screens.extend(loaded if isinstance(loaded, list) else [loaded])
+    return screens or [{}]
+
+
+# Time points are hours; JSON object keys and NAME=PATH arguments arrive as strings
+def time_point(value):
+    value = str(value)
+    return int(value) if value.isdigit() else float(value)
+
+
+def normalize_config(pipeline, config):
+    if pipeline == 'time-points' and 'time_point_files' in config:
+        config['time_point_files'] = {time_point(time): path for time, path in config['time_point_files'].items()}
+    return config
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run the CBCS analysis pipelines on one or more screens in a single process.")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Logging level")
+    subparsers = parser.add_subparsers(dest='pipeline', required=True)
+
+    cell_lines = subparsers.add_parser('cell-lines', help="Combine IC50 curves of several cell lines per drug")
+    cell_lines.add_argument('--cell-line', action='append', default=[], metavar='NAME=PATH',
+                            help="R-pipeline IC50 table of one cell line (repeat for each cell line)")
+    cell_lines.add_argument('--output-dir', help="Folder for the plots (none are drawn without it)")
+    cell_lines.add_argument('--excel-path', help="Summary workbook to write")
+
+    time_points = subparsers.add_parser('time-points', help="Merge dose-response curves of several time points per batch")
+    time_points.add_argument('--time-point', action='append', default=[], metavar='HOURS=PATH',
+                             help="Dose-response table of one time point (repeat for each time point)")
+    time_points.add_argument('--long-format-file', help="One long-format table with Batch_nr, Conc_nM, inhibition and the condition columns")
+    time_points.add_argument('--condition-columns', nargs='+', metavar='COLUMN', help="Columns that together identify a condition")
+    time_points.add_argument('--time-shift-column', help="Add IC50 fold changes and AUC differences along this condition column")
+    initial_guesses = time_points.add_mutually_exclusive_group()
+    initial_guesses.add_argument('--initial-guess-file', help="Initial IC50 and slope guesses per batch (default: none)")
+    initial_guesses.add_argument('--no-initial-guesses', action='store_true',
+                                 help="Start every fit from data-driven guesses, even where a config file names an initial guess file")
+    time_points.add_argument('--figures-dir', help="Folder for the plots (none are drawn without it)")
+    time_points.add_argument('--excel-path', help="Summary workbook to write")
+    time_points.add_argument('--auc-domain', choices=['linear', 'log10'], help="AUC integration domain")
+
+    breeze = subparsers.add_parser('breeze', help="Convert Harmony TXT exports to a BREEZE input table")
+    breeze.add_argument('--input-folder', help="Folder with the Harmony TXT exports")
+    breeze.add_argument('--conversion-file', help="Barcode to PlateID conversion workbook")
+    breeze.add_argument('--platemap', help="Plate map workbook")
+    breeze.add_argument('--output-file-path', help="BREEZE workbook to write")
+    breeze.add_argument('--legacy', action='store_false', dest='streaming', default=None,
+                        help="Run the original CSV/XLSX round-trip chain instead of the streaming pipeline")
+    breeze.add_argument('--csv-folder', help="Folder for the intermediate CSV files (with --legacy)")
+    breeze.add_argument('--excel-folder', help="Folder for the intermediate per-plate workbooks (with --legacy)")
+    breeze.add_argument('--combined-file-path', help="Intermediate workbook of all plates (with --legacy)")
+    breeze.add_argument('--matched-file-path', help="Intermediate workbook joined with the plate map (with --legacy)")
+    breeze.add_argument('--row-start', type=int, help="Row of the data header in the TXT exports")
+    breeze.add_argument('--plate-format', type=int, choices=[96, 384, 1536], help="Wells per plate")
+    breeze.add_argument('--screen-name', help="SCREEN_NAME written to every row")
+    breeze.add_argument('--threads', type=int, dest='n_threads', help="Threads parsing the TXT exports concurrently")
+
+    for subparser in (cell_lines, time_points):
+        subparser.add_argument('--workers', type=int, dest='n_workers', help="Worker processes for fitting and plotting (default: one per CPU)")
+        subparser.add_argument('--result-store-path', help="Store of fitted results for incremental runs, one tab-separated JSON key and entry per line (.tsv)")
+        subparser.add_argument('--full', action='store_false', dest='incremental', default=None,
+                               help="Refit everything instead of reusing stored results")
+        subparser.add_argument('--no-plots', action='store_false', dest='render_plots', default=None,
+                               help="Skip drawing the PNGs")
+        subparser.add_argument('--plots', action='store_true', dest='render_plots', default=None,
+                               help="Draw the PNGs even for --output-format html, whose report draws the curves itself")
+        subparser.add_argument('--plot-dpi', type=int, help="Resolution of the PNGs")
+        subparser.add_argument('--output-format', choices=['xlsx', 'html', 'both'],
+                               help="Summary workbook with embedded PNGs, a sortable HTML report drawing the curves, or both")
+        subparser.add_argument('--confidence-level', type=float, help="Report IC50 confidence intervals at this level (e.g. 0.95)")
+        subparser.add_argument('--bootstrap-samples', type=int, help="Residual resamples refitted per curve for the bootstrap intervals (0 skips them)")
+
+    for subparser in (cell_lines, time_points, breeze):
+        subparser.add_argument('--memory-budget-mb', type=float,
+                               help="Process the screen in chunks that fit this many MB, through an on-disk Parquet store")
+        subparser.add_argument('--config', action='append', default=[], metavar='FILE',
+                               help="JSON settings of a screen, keys as in default_config() (repeat to run several screens)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    configure_logging(getattr(logging, args.log_level))
+    pipeline = pipelines[args.pipeline]
+
+    # Settings given on the command line override those of every config file
+    overrides = {key: value for key, value in vars(args).items()
+                 if key not in ('pipeline', 'config', 'cell_line', 'time_point', 'no_initial_guesses', 'log_level') and value is not None}
+    if args.pipeline == 'cell-lines' and args.cell_line:
+        overrides['file_paths'] = parse_mapping(args.cell_line)
+    if args.pipeline == 'time-points' and args.time_point:
+        overrides['time_point_files'] = parse_mapping(args.time_point, key_type=time_point)
+    if args.pipeline == 'time-points' and args.no_initial_guesses:
+        overrides['initial_guess_file'] = None
+
+    results = []
+    for screen in load_screens(args.config):
+        config = dict(cli_defaults.get(args.pipeline, {}), **normalize_config(args.pipeline, screen))
+        config.update(overrides)
+        results.append(pipeline.main(config))
+    return results
+
+
+if __name__ == '__main__':
+    main()
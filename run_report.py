@@ -0,0 +1,130 @@
+import contextlib
+import json
+import logging
+import platform
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Columns of the per-fit CSV, in order; fit records may leave any of them empty
+fit_columns = ['key', 'label', 'status', 'evaluations', 'seconds', 'r_squared', 'rmse', 'cached']
+
+
+# Timestamped log lines on stderr, unless the caller already set up logging
+def configure_logging(level=logging.INFO):
+    logging.basicConfig(level=level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+
+# High-water mark of the resident memory of this process and its finished children, in MB: getrusage where available
+# (Linux/macOS), psutil's peak working set on Windows, None when neither can tell
+def peak_memory_mb():
+    if resource is not None:
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss) / 2 ** 20
+    return None
+
+
+# R² and RMSE of each row of predicted against observed (NaN where a fit is missing)
+def fit_quality(observed, predicted):
+    observed = np.atleast_2d(np.asarray(observed, dtype=float))
+    predicted = np.atleast_2d(np.asarray(predicted, dtype=float))
+    residual_ss = np.sum((observed - predicted) ** 2, axis=1)
+    total_ss = np.sum((observed - observed.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(total_ss > 0, 1 - residual_ss / total_ss, np.nan)
+    rmse = np.sqrt(residual_ss / observed.shape[1])
+    return r_squared, rmse
+
+
+# Stage timings, per-fit statistics and the memory high-water mark of one pipeline run
+# Stages are timed with `with report.stage(name):`, fit records are dicts with the fit_columns keys, and write()
+# puts a JSON summary and a CSV of the fits next to each other
+class RunReport:
+    def __init__(self, name):
+        self.name = name
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.stages = {}
+        self.fits = []
+
+    @contextlib.contextmanager
+    def stage(self, name, items=None):
+        start = time.perf_counter()
+        yield
+        self.add_stage(name, time.perf_counter() - start, items)
+
+    # Record a stage timed elsewhere, e.g. the share of a worker pool's wall time spent on one kind of work
+    # A stage entered more than once (e.g. per chunk) accumulates
+    def add_stage(self, name, seconds, items=None):
+        entry = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0 if items is not None else None, 'calls': 0})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if items is not None:
+            entry['items'] = (entry['items'] or 0) + items
+        entry['peak_memory_mb'] = peak_memory_mb()
+        logger.info("%s: %s took %.3f s", self.name, name, seconds)
+
+    def add_fits(self, records):
+        self.fits.extend(records)
+
+    def summary(self):
+        fits = pd.DataFrame(self.fits, columns=fit_columns)
+        for column in ['evaluations', 'seconds', 'r_squared', 'rmse']:
+            fits[column] = pd.to_numeric(fits[column], errors='coerce')
+        fresh = fits[fits['cached'] != True]
+        return {
+            'name': self.name,
+            'started': self.started,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'peak_memory_mb': peak_memory_mb(),
+            'stages': {name: dict(entry, seconds=round(entry['seconds'], 6)) for name, entry in self.stages.items()},
+            'total_seconds': round(sum(entry['seconds'] for entry in self.stages.values()), 6),
+            'fits': {
+                'total': len(fits),
+                'fitted_this_run': len(fresh),
+                'status': {str(status): int(count) for status, count in fits['status'].value_counts().items()},
+                'median_evaluations': _json_float(fresh['evaluations'].median()),
+                'median_r_squared': _json_float(fits['r_squared'].median()),
+                'slowest': fresh.nlargest(10, 'seconds')[['key', 'label', 'seconds', 'evaluations']].to_dict('records')
+            }
+        }
+
+    # Write <base_path>.json (summary) and, if there were fits, <base_path>_fits.csv (one row per fit)
+    # Returns both paths; the CSV path is None when nothing was fitted
+    def write(self, base_path):
+        json_path = base_path + '.json'
+        with open(json_path, 'w') as report_file:
+            json.dump(self.summary(), report_file, indent=2, default=_json_float)
+        csv_path = None
+        if self.fits:
+            csv_path = base_path + '_fits.csv'
+            pd.DataFrame(self.fits, columns=fit_columns).to_csv(csv_path, index=False)
+        logger.info("%s: run report written to %s", self.name, ' and '.join(path for path in (json_path, csv_path) if path))
+        return json_path, csv_path
+
+
+# NaN is not valid JSON; NumPy scalars are not serializable by json directly
+def _json_float(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
@@ -0,0 +1,137 @@
+import logging
+import math
+import os
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+
+# Anchor each plot in the 'GRAPH' column of its row, scaled to fit the cell
+# plot_filenames holds (png path, worksheet row) pairs; None paths are skipped. The images are embedded when the
+# workbook is saved, so no Excel instance is needed, and only the PNG headers are read for their dimensions
+def add_graph_images(ws, plot_filenames, row_height=120):
+
+    # Find the column named "GRAPH"
+    graph_col = None
+    for cell in ws[1]:
+        if cell.value == 'GRAPH':
+            graph_col = cell.column
+            break
+
+    if graph_col is None:
+        raise ValueError("The column 'GRAPH' was not found in the Excel sheet.")
+
+    graph_col_letter = get_column_letter(graph_col)
+    col_width = (ws.column_dimensions[graph_col_letter].width or 8.43) * 7.5  # Approximate width in points
+
+    for pic_path, row_idx in plot_filenames:
+        img = _scaled_image(pic_path, col_width, row_height)
+        if img is None:
+            continue
+
+        # Set row height
+        ws.row_dimensions[row_idx].height = row_height
+        img.anchor = f'{graph_col_letter}{row_idx}'
+        ws.add_image(img)
+
+
+# The plot at pic_path scaled to fit a col_width x row_height (points) cell, or None if there is no plot
+# Rows without a rendered plot keep an empty GRAPH cell
+def _scaled_image(pic_path, col_width, row_height):
+    if pic_path is None:
+        return None
+
+    # Verify that the image file exists
+    if not os.path.exists(pic_path):
+        logger.warning("File not found: %s", pic_path)
+        return None
+
+    img = Image(pic_path)
+    aspect_ratio = img.width / img.height
+    width = col_width
+    height = width / aspect_ratio
+
+    if height > row_height:
+        height = row_height
+        width = height * aspect_ratio
+
+    # openpyxl sizes images in pixels (96 per inch), the layout above is in points (72 per inch)
+    img.width = round(width * 96 / 72)
+    img.height = round(height * 96 / 72)
+    return img
+
+
+# Cell values of one summary row with an empty GRAPH cell
+# NaN becomes an empty cell; an infinite bound (e.g. a confidence interval that runs off to infinity)
+# is written as the text 'inf' or '-inf', which has no numeric cell value in Excel
+def _row_values(values, graph_idx):
+    row = []
+    for value in values[:graph_idx] + ('',) + values[graph_idx + 1:]:
+        if isinstance(value, float) and math.isnan(value):
+            value = None
+        elif isinstance(value, float) and math.isinf(value):
+            value = 'inf' if value > 0 else '-inf'
+        row.append(value)
+    return row
+
+
+# Write a summary table to a new workbook; the GRAPH column holds each row's PNG path (None without a plot),
+# which is embedded on top of the empty cell
+def write_summary_workbook(summary, excel_path, sheet_title, graph_width=40):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = sheet_title
+
+    # Write the header row
+    header = list(summary.columns)
+    ws.append(header)
+
+    # Adjust column width for the 'GRAPH' column
+    graph_idx = header.index('GRAPH')
+    ws.column_dimensions[get_column_letter(graph_idx + 1)].width = graph_width
+
+    plot_filenames = []
+    for values in summary.itertuples(index=False, name=None):
+        row_idx = ws.max_row + 1
+        ws.append(_row_values(values, graph_idx))
+        # Missing plots may come back from the DataFrame as NaN instead of None
+        plot_filename = values[graph_idx]
+        plot_filenames.append((plot_filename if isinstance(plot_filename, str) else None, row_idx))
+
+    # Embed the plots in the GRAPH column and write the workbook once
+    add_graph_images(ws, plot_filenames)
+    wb.save(excel_path)
+
+
+# write_summary_workbook for a summary that arrives as a sequence of DataFrame chunks
+# The workbook is write-only, so no cells are kept in memory: each row's height and plot are set as it is written,
+# and the PNGs are only read when the file is saved
+def write_summary_workbook_streaming(summaries, excel_path, sheet_title, graph_width=40, row_height=120):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    col_width = graph_width * 7.5  # Approximate width in points
+
+    row_idx = 1
+    graph_idx = None
+    for summary in summaries:
+        if graph_idx is None:
+            # Write the header row
+            header = list(summary.columns)
+            graph_idx = header.index('GRAPH')
+            graph_col_letter = get_column_letter(graph_idx + 1)
+            ws.column_dimensions[graph_col_letter].width = graph_width
+            ws.append(header)
+
+        for values in summary.astype(object).where(summary.notna(), None).itertuples(index=False, name=None):
+            row_idx += 1
+            plot_filename = values[graph_idx]
+            img = _scaled_image(plot_filename if isinstance(plot_filename, str) else None, col_width, row_height)
+            if img is not None:
+                ws.row_dimensions[row_idx].height = row_height
+                img.anchor = f'{graph_col_letter}{row_idx}'
+                ws.add_image(img)
+            ws.append(_row_values(values, graph_idx))
+
+    wb.save(excel_path)
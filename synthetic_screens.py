@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pandas as pd
+from Harmony_output_reformat_for_BREEZE import make_well_ids, plate_layouts
+
+# Dilution series of the R-pipeline tables (D1..D5) and concentrations (nM) of the time-point tables
+dilutions = np.array([10000, 1000, 100, 10, 1])
+time_point_concentrations = np.array([1, 3, 10, 30, 100, 300, 1000, 3000, 10000])
+
+
+# Falling Hill curve (as hill_equation in the cell-line script) plus Gaussian noise
+def hill_responses(concentrations, ic50, slope, min_resp, max_resp, noise, rng):
+    ratio = np.asarray(concentrations, dtype=float) / ic50
+    responses = min_resp + (max_resp - min_resp) / (1 + ratio ** slope)
+    return responses + rng.normal(0, noise, np.shape(responses))
+
+
+# R-pipeline IC50 tables (ID, DRUG_NAME, D1..D5, IC50, DSS, SLOPE, MAX, MIN, Max.Conc.tested) per cell line
+def make_cell_line_tables(n_drugs, cell_lines=('HL60', 'Kuramochi', 'MOLM13', 'Ovcar8'), seed=0, noise=3.0):
+    rng = np.random.default_rng(seed)
+    drug_names = [f'drug{i}' for i in range(n_drugs)]
+    tables = {}
+    for cell_line in cell_lines:
+        max_conc = np.full(n_drugs, 10000.0)
+        ic50 = 10 ** rng.uniform(0, 4, n_drugs)
+        slope = rng.uniform(0.5, 2.5, n_drugs)
+        min_resp = rng.uniform(0, 10, n_drugs)
+        max_resp = rng.uniform(85, 100, n_drugs)
+        # Responses fall from MAX to MIN with concentration, as in the reversed-sign R-pipeline tables
+        concentrations = max_conc[:, None] / dilutions
+        responses = hill_responses(concentrations, ic50[:, None], slope[:, None], min_resp[:, None], max_resp[:, None], noise, rng)
+        table = pd.DataFrame({'ID': [f'{cell_line}_{i}' for i in range(n_drugs)], 'DRUG_NAME': drug_names})
+        for j in range(len(dilutions)):
+            table[f'D{j + 1}'] = responses[:, j]
+        # R-pipeline estimates: the true parameters with some scatter, as starting values for the fit
+        table['IC50'] = ic50 * 10 ** rng.normal(0, 0.2, n_drugs)
+        table['DSS'] = rng.uniform(0, 40, n_drugs)
+        table['SLOPE'] = slope * rng.uniform(0.8, 1.2, n_drugs)
+        table['MAX'] = max_resp
+        table['MIN'] = min_resp
+        table['Max.Conc.tested'] = max_conc
+        tables[cell_line] = table
+    return tables
+
+
+# Dose-response tables (Batch_nr, Conc_nM, inhibition) per time point and the initial guess table,
+# with IC50_<t> in M and Slope_<t> columns as the U2OS guess workbook
+def make_time_point_tables(n_batches, time_points=(24, 72), seed=0, noise=3.0):
+    rng = np.random.default_rng(seed)
+    batches = np.array([f'B{i}' for i in range(n_batches)])
+    initial_guesses = pd.DataFrame({'Batch_nr': batches})
+    tables = {}
+    for time in time_points:
+        ic50 = 10 ** rng.uniform(0.5, 3.5, n_batches)
+        slope = rng.uniform(0.7, 2.0, n_batches)
+        # Inhibition rises from about 0 to 60-100 % with concentration (a negative Hill slope)
+        inhibition = hill_responses(time_point_concentrations, ic50[:, None], -slope[:, None], 0.0, rng.uniform(60, 100, n_batches)[:, None], noise, rng)
+        tables[time] = pd.DataFrame({
+            'Batch_nr': np.repeat(batches, len(time_point_concentrations)),
+            'Conc_nM': np.tile(time_point_concentrations, n_batches),
+            'inhibition': inhibition.ravel()
+        })
+        initial_guesses[f'IC50_{time}'] = ic50 * 10 ** rng.normal(0, 0.3, n_batches) * 1e-9
+        initial_guesses[f'Slope_{time}'] = 1.0
+    return tables, initial_guesses
+
+
+# Per-plate Harmony signals, the barcode conversion table and the plate map for n_compounds, as (plates, conversion,
+# platemap) with plates a list of (barcode, signals) in plate-well order
+# The first two and last two columns of every plate hold controls (DMSO and TAM), the other wells one compound each
+def make_harmony_plates(n_compounds, plate_format=384, seed=0):
+    rng = np.random.default_rng(seed)
+    n_rows, n_cols = plate_layouts[plate_format]
+    well_ids = np.array(make_well_ids(plate_format))
+    columns = np.tile(np.arange(1, n_cols + 1), n_rows)
+    control = np.where(np.isin(columns, [1, n_cols]), 'DMSO', np.where(np.isin(columns, [2, n_cols - 1]), 'TAM', ''))
+    compound_wells = np.flatnonzero(control == '')
+    n_plates = max(1, -(-n_compounds // len(compound_wells)))
+
+    plates = []
+    conversion = []
+    platemaps = []
+    for plate in range(n_plates):
+        barcode = f'BC{plate:05d}'
+        plate_id = f'P{plate:05d}'
+        batch = control.astype(object)
+        first = plate * len(compound_wells)
+        count = min(len(compound_wells), max(n_compounds - first, 0))
+        batch[compound_wells[:count]] = [f'drug{first + i}' for i in range(count)]
+        batch[compound_wells[count:]] = 'DMSO'
+        signals = rng.poisson(np.where(batch == 'TAM', 40, 400))
+        plates.append((barcode, signals))
+        conversion.append((barcode, plate_id))
+        platemaps.append(pd.DataFrame({
+            'Platt ID': plate_id,
+            'Well': well_ids,
+            'Batch nr': batch,
+            'Compound ID': [f'C{plate}_{i}' for i in range(len(well_ids))],
+            'Conc (mM)': 10
+        }))
+    return plates, pd.DataFrame(conversion, columns=['Barcode', 'PlateID']), pd.concat(platemaps, ignore_index=True)
+
+
+# Write each plate as a Harmony TXT export: a header block with the barcode on line 4 and the column header on line row_start
+def write_harmony_plates(folder, plates, row_start=9):
+    os.makedirs(folder, exist_ok=True)
+    for barcode, signals in plates:
+        n_rows, n_cols = plate_layouts[len(signals)]
+        header = ['[General]', 'Version\t1', 'Date\t2024-01-01', f'Plate Name\t{barcode}']
+        header += [f'Info\t{i}' for i in range(row_start - 6)] + ['[Data]']
+        with open(os.path.join(folder, f'{barcode}.txt'), 'w') as txt_file:
+            txt_file.write('\n'.join(header) + '\n')
+            txt_file.write('Row\tColumn\tPlane\tCell Selected - Number of Objects\tCell Selected - Area [um2]\n')
+            for well, signal in enumerate(signals):
+                txt_file.write(f'{well // n_cols + 1}\t{well % n_cols + 1}\t1\t{signal}\t{signal * 2.5:.1f}\n')
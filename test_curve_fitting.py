@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from scipy.integrate import quad
+from scipy.optimize import curve_fit
+from hill_fitting import fit_hill_batch
+from combine_IC50curves_by_cell_line import dilutions, hill_equation
+from merge_IC50curves_by_timepoints import dose_response_curve, logistic_auc, logistic_model
+
+
+# Noisy Hill curves over the script's dilution series, with R-pipeline style starting values
+def synthetic_hill_rows(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    concentrations = rng.uniform(1e3, 1e5, n_rows)[:, None] / dilutions
+    ic50 = np.exp(rng.uniform(np.log(concentrations.min(axis=1)), np.log(concentrations.max(axis=1))))
+    params = np.column_stack([ic50, rng.uniform(0.5, 3, n_rows), rng.uniform(0, 20, n_rows), rng.uniform(70, 100, n_rows)])
+    responses = hill_equation(concentrations, *(params[:, [i]] for i in range(4))) + rng.normal(0, 3, concentrations.shape)
+    initial_guesses = params * rng.uniform(0.5, 2, params.shape)
+    return concentrations, responses, initial_guesses
+
+
+def squared_error(concentrations, responses, params):
+    return np.sum((hill_equation(concentrations, *params) - responses) ** 2)
+
+
+# On the rows the batched fit converged on, its cost must be no worse than that of the per-row curve_fit it replaced
+# Both are local optimizers that now and then settle in different minima, so a few rows may end up either way
+def test_fit_hill_batch_cost_no_worse_than_curve_fit():
+    concentrations, responses, initial_guesses = synthetic_hill_rows(200)
+    *params, evaluations, early_exit = fit_hill_batch(concentrations, responses, initial_guesses)
+    fitted = np.column_stack(params)
+    batch_costs, reference_costs = [], []
+    for row in range(len(responses)):
+        try:
+            popt, _ = curve_fit(hill_equation, concentrations[row], responses[row], p0=initial_guesses[row], bounds=(0, np.inf), maxfev=2000)
+        except RuntimeError:
+            continue
+        if np.all(np.isfinite(fitted[row])) and not early_exit[row]:
+            batch_costs.append(squared_error(concentrations[row], responses[row], fitted[row]))
+            reference_costs.append(squared_error(concentrations[row], responses[row], popt))
+    batch_costs, reference_costs = np.array(batch_costs), np.array(reference_costs)
+    assert len(batch_costs) >= 100
+    assert np.mean(batch_costs > reference_costs * (1 + 1e-6) + 1e-9) <= 0.05
+    assert np.median(batch_costs / reference_costs) <= 1 + 1e-6
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_fit_hill_batch_non_finite_and_flat_rows_are_nan():
+    concentrations = np.tile(1e4 / dilutions, (4, 1))
+    responses = np.array([
+        [90.0, 70.0, np.nan, 20.0, 10.0],
+        [90.0, np.inf, 50.0, 20.0, 10.0],
+        [50.0, 50.0, 50.0, 50.0, 50.0],
+        [95.0, 80.0, 50.0, 20.0, 5.0],
+    ])
+    ic50, slope, min_resp, max_resp, evaluations, early_exit = fit_hill_batch(concentrations, responses, np.full((4, 4), np.nan))
+    for values in (ic50, slope, min_resp, max_resp):
+        assert np.all(np.isnan(values[:3]))
+    assert np.all(evaluations[:3] == 0)
+    assert not np.any(early_exit[:3])
+    assert np.isfinite(ic50[3])
+
+
+@pytest.mark.parametrize('D', [1.3, -0.8, 0.0])
+@pytest.mark.parametrize('domain', ['linear', 'log10'])
+def test_logistic_auc_matches_numerical_integral(D, domain):
+    A, B, C, x_low, x_high = 10.0, 90.0, 50.0, 1.0, 1000.0
+    if domain == 'linear':
+        expected, _ = quad(logistic_model, x_low, x_high, args=(A, B, C, D), points=[C], limit=200)
+    else:
+        expected, _ = quad(lambda u: logistic_model(10 ** u, A, B, C, D), np.log10(x_low), np.log10(x_high))
+    assert logistic_auc(A, B, C, D, x_low, x_high, domain=domain) == pytest.approx(expected, rel=1e-8)
+
+
+# A vehicle point at Conc_nM = 0 has no logarithm; the log-space fit must still match the fit of logistic_model on the
+# raw concentrations, where x = 0 sits on the lower plateau
+def test_dose_response_curve_fits_zero_concentration():
+    conc = np.array([0, 1, 3, 10, 30, 100, 300, 1000], dtype=float)
+    rng = np.random.default_rng(0)
+    with np.errstate(divide='ignore'):
+        inhib = logistic_model(conc, 0.5, 92.0, 38.0, 1.2) + rng.normal(0, 1.5, conc.size)
+        reference, _ = curve_fit(logistic_model, conc, inhib, p0=[0, 100, 30, 1], maxfev=100000)
+    ic50, area, popt, evaluations, log_ic50_se = dose_response_curve(conc, inhib, '24h', 1, np.nan, np.nan)
+    assert np.allclose(popt, reference, rtol=1e-3, atol=1e-3)
+    assert ic50 == pytest.approx(reference[2], rel=1e-3)
+    assert np.isfinite(area) and np.isfinite(log_ic50_se)
+    assert np.isfinite(dose_response_curve(conc, inhib, '24h', 1, np.nan, np.nan, auc_domain='log10')[1])
+
+
+def test_dose_response_curve_without_positive_concentrations_is_nan():
+    ic50, area, popt, evaluations, log_ic50_se = dose_response_curve(np.zeros(5), np.arange(5.0), '24h', 1, np.nan, np.nan)
+    assert np.isnan(ic50) and np.isnan(area) and np.all(np.isnan(popt))
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import combine_IC50curves_by_cell_line as cell_line_pipeline
+import merge_IC50curves_by_timepoints as time_point_pipeline
+import Harmony_output_reformat_for_BREEZE as breeze_pipeline
+from data_partition import partition_frame
+from run_report import RunReport
+from synthetic_screens import make_cell_line_tables, make_time_point_tables, make_harmony_plates, write_harmony_plates
+
+
+# Settings shared by the curve runs below: no PNGs, no run report, summary workbook only
+quiet_run = {'render_plots': False, 'run_report': False, 'output_format': 'xlsx'}
+
+
+def write_tables(folder, tables):
+    paths = {}
+    for name, table in tables.items():
+        paths[name] = os.path.join(folder, f'{name}.xlsx')
+        table.to_excel(paths[name], index=False)
+    return paths
+
+
+def test_partition_frame_keeps_unique_order_and_row_order():
+    frame = pd.DataFrame({'key': ['b', 'a', 'b', None, 'c', 'a', 'b'], 'value': range(7)})
+    parts = partition_frame(frame, 'key')
+    assert [key for key, _ in parts] == list(frame['key'].dropna().unique())
+    for key, part in parts:
+        pd.testing.assert_frame_equal(part, frame[frame['key'] == key])
+
+
+# The streaming pipeline and the chunked one (several chunks of plates) must write the table of the legacy CSV/XLSX chain
+def test_breeze_streaming_and_chunked_match_legacy_chain(tmp_path):
+    plates, conversion, platemap = make_harmony_plates(900, plate_format=384)
+    write_harmony_plates(tmp_path / 'txt', plates, row_start=9)
+    paths = write_tables(tmp_path, {'conversion': conversion, 'platemap': platemap})
+    config = {'input_folder': str(tmp_path / 'txt'), 'conversion_file': paths['conversion'], 'platemap': paths['platemap'],
+              'row_start': 9, 'plate_format': 384, 'run_report': False, 'n_threads': 1}
+    outputs = {}
+    for name, settings in [('legacy', {'streaming': False, 'memory_budget_mb': None}),
+                           ('streaming', {'streaming': True, 'memory_budget_mb': None}),
+                           ('chunked', {'streaming': True, 'memory_budget_mb': 0.01})]:
+        outputs[name] = str(tmp_path / f'{name}.xlsx')
+        breeze_pipeline.main(dict(config, **settings, output_file_path=outputs[name], csv_folder=str(tmp_path / 'csv'),
+                                  excel_folder=str(tmp_path / 'excel'), combined_file_path=str(tmp_path / 'combined.xlsx'),
+                                  matched_file_path=str(tmp_path / 'matched.xlsx')))
+    assert pq.ParquetFile(tmp_path / 'chunked.parquet').num_row_groups > 1
+    legacy = pd.read_excel(outputs['legacy'])
+    assert len(legacy) == 3 * 384
+    pd.testing.assert_frame_equal(pd.read_excel(outputs['streaming']), legacy)
+    pd.testing.assert_frame_equal(pd.read_excel(outputs['chunked']), legacy)
+
+
+# A run within a memory budget summarizes chunk by chunk; its summary workbook must equal that of the in-memory run
+def test_cell_line_chunked_summary_matches_in_memory(tmp_path):
+    file_paths = write_tables(tmp_path, make_cell_line_tables(40, seed=1))
+    summaries = {}
+    for name, budget in [('full', None), ('chunked', 0.05)]:
+        summaries[name] = str(tmp_path / f'{name}.xlsx')
+        cell_line_pipeline.main(dict(quiet_run, file_paths=file_paths, excel_path=summaries[name], memory_budget_mb=budget))
+    assert pq.ParquetFile(tmp_path / 'chunked_summary.parquet').num_row_groups > 1
+    pd.testing.assert_frame_equal(pd.read_excel(summaries['chunked']), pd.read_excel(summaries['full']))
+
+
+def test_time_point_chunked_summary_matches_in_memory(tmp_path):
+    tables, initial_guesses = make_time_point_tables(30, seed=1)
+    paths = write_tables(tmp_path, {f'tp{time}': table for time, table in tables.items()} | {'guesses': initial_guesses})
+    time_point_files = {time: paths[f'tp{time}'] for time in tables}
+    summaries = {}
+    for name, budget in [('full', None), ('chunked', 0.02)]:
+        summaries[name] = str(tmp_path / f'{name}.xlsx')
+        time_point_pipeline.main(dict(quiet_run, time_point_files=time_point_files, initial_guess_file=paths['guesses'],
+                                      excel_path=summaries[name], memory_budget_mb=budget))
+    assert pq.ParquetFile(tmp_path / 'chunked_summary.parquet').num_row_groups > 1
+    pd.testing.assert_frame_equal(pd.read_excel(summaries['chunked']), pd.read_excel(summaries['full']))
+
+
+# A rerun refits only the drugs whose rows changed and reuses the stored results of the rest
+def test_incremental_rerun_reuses_unchanged_drugs(tmp_path):
+    data = cell_line_pipeline.load_cell_lines(write_tables(tmp_path, make_cell_line_tables(12, seed=2)))
+    config = {'result_store_path': str(tmp_path / 'store.tsv')}
+    cell_line_pipeline.summarize_cell_lines(data, config=config)
+
+    changed = data.copy()
+    changed.loc[changed['DRUG_NAME'] == 'drug3', 'D3'] += 5
+    report = RunReport('rerun')
+    rerun = cell_line_pipeline.summarize_cell_lines(changed, config=config, report=report)
+    cached = {fit['key']: fit['cached'] for fit in report.fits}
+    assert cached == {f'drug{i}': i != 3 for i in range(12)}
+    assert report.stages['fit']['items'] == int(np.sum(changed['DRUG_NAME'] == 'drug3'))
+    pd.testing.assert_frame_equal(rerun, cell_line_pipeline.summarize_cell_lines(changed))